@@ -0,0 +1,124 @@
+"""Measure note-on latency while the GUI is busy, in the single
+process layout and in the layout of ``midi2sc.multiproc``.
+
+A scheduled MIDI source emits note-on/note-off pairs at a fixed rate.
+The latency of a note-on is the time between when it was due and when
+the ``/s_new`` for it reaches the (stubbed) server.  Meanwhile, a GUI
+load alternates between bursts of Python work, like a Tk redraw, and
+idle time.
+
+Run it like so::
+
+  $ python -m midi2sc.benchmarks.latency --events 2000
+"""
+
+import functools
+import multiprocessing
+import optparse
+import threading
+import time
+
+from midi2sc import control
+from midi2sc import core
+from midi2sc import multiproc
+from midi2sc.benchmarks.stubs import ScheduledMidi
+from midi2sc.benchmarks.stubs import StubServer
+
+def gui_load(stop, busy=0.02, idle=0.03):
+    """Keep the interpreter busy for ``busy`` seconds out of every
+    ``busy + idle`` seconds, until ``stop`` is set.
+    """
+    while not stop.is_set():
+        until = time.time() + busy
+        while time.time() < until:
+            sum([i * i for i in range(200)])
+        time.sleep(idle)
+
+def _handlers():
+    noteon = control.NoteOnControl('bench')
+    return {0x90: noteon, 0x80: control.NoteOffControl(noteon.notes)}
+
+def _latencies(start, interval, s_new_times):
+    return [t - (start + i * interval)
+            for i, t in enumerate(s_new_times)]
+
+def run_single(count, interval):
+    server = StubServer()
+    core.set_server(server)
+    core.set_verbosity(0)
+
+    start = time.time() + 0.2
+    midi_in = core.MidiIn(ScheduledMidi(start, count, interval), 0,
+                          handlers=_handlers())
+    stop = threading.Event()
+    load = threading.Thread(target=gui_load, args=(stop,))
+    load.start()
+    midi_in.start()
+
+    time.sleep(start + count * interval + 0.2 - time.time())
+    midi_in.running = False
+    stop.set()
+    load.join()
+    return _latencies(start, interval, server.s_new_times)
+
+def _bench_control_process(ring, stop, results):
+    server = StubServer()
+    core.set_server(server)
+    multiproc.ControlLoop(ring, _handlers()).run(stop)
+    results.put(server.s_new_times)
+
+def run_multi(count, interval):
+    ring = multiproc.EventRing()
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+
+    start = time.time() + 0.5
+    midi_factory = functools.partial(ScheduledMidi, start, count, interval)
+    processes = [
+        multiprocessing.Process(target=_bench_control_process,
+                                args=(ring, stop, results)),
+        multiprocessing.Process(target=multiproc.midi_process,
+                                args=(ring, midi_factory, 0, stop)),
+        multiprocessing.Process(target=gui_load, args=(stop,)),
+        ]
+    for process in processes:
+        process.start()
+
+    time.sleep(start + count * interval + 0.2 - time.time())
+    stop.set()
+    s_new_times = results.get()
+    for process in processes:
+        process.join()
+    return _latencies(start, interval, s_new_times)
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    ms = lambda value: value * 1000.0
+    return dict(
+        count=n,
+        mean=ms(sum(latencies) / n),
+        median=ms(latencies[n // 2]),
+        p99=ms(latencies[min(n - 1, int(n * 0.99))]),
+        max=ms(latencies[-1]),
+        )
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--events", dest="events", type="int",
+                      default=1000, help="Number of note-ons [1000]")
+    parser.add_option("-i", "--interval", dest="interval", type="float",
+                      default=0.005,
+                      help="Seconds between note-ons [0.005]")
+    options, args = parser.parse_args()
+
+    print '%-8s %6s %9s %9s %9s %9s' % (
+        'layout', 'count', 'mean ms', 'median ms', 'p99 ms', 'max ms')
+    for name, run in (('single', run_single), ('multi', run_multi)):
+        stats = summarize(run(options.events, options.interval))
+        print '%-8s %6d %9.3f %9.3f %9.3f %9.3f' % (
+            name, stats['count'], stats['mean'], stats['median'],
+            stats['p99'], stats['max'])
+
+if __name__ == '__main__':
+    main()
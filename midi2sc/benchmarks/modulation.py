@@ -0,0 +1,78 @@
+"""Measure how long one tick of the ``ModulationEngine`` takes with a
+given number of modulated parameters, and whether the engine keeps up
+with its control rate.
+
+Run it like so::
+
+  $ python -m midi2sc.benchmarks.modulation --params 1000 --voices 2
+"""
+
+import optparse
+import time
+
+from midi2sc import core
+from midi2sc import modulation
+
+def setup(params, voices, params_per_group=10):
+    """Create an engine with ``params`` modulators, spread over groups
+    of ``params_per_group`` parameters with ``voices`` synths each.
+    """
+    engine = modulation.ModulationEngine()
+    shapes = modulation.SHAPES
+    modulators = []
+    for index in range(params):
+        group = 'bench%d' % (index // params_per_group)
+        param_name = 'param%d' % (index % params_per_group)
+        if index % 4 == 3:
+            modulators.append(modulation.Envelope(
+                group, param_name=param_name, base=1.0, depth=0.5))
+        else:
+            modulators.append(modulation.LFO(
+                group, param_name=param_name, base=1.0,
+                shape=shapes[index % len(shapes)],
+                rate=0.1 + index % 7, depth=0.5))
+    engine.reset(modulators)
+    for group in sorted(set(m.group for m in modulators)):
+        for voice in range(voices):
+            core.Synth(group)
+    return engine
+
+def run(params, voices, ticks=200, rate=100.0):
+    engine = setup(params, voices)
+    now = time.time()
+    durations = []
+    for tick in range(ticks):
+        started = time.time()
+        engine.tick(now + tick / rate)
+        durations.append(time.time() - started)
+        del core.Synth.messages[:]
+    durations.sort()
+    return dict(
+        params=params,
+        voices=voices,
+        mean=sum(durations) / len(durations),
+        p99=durations[min(len(durations) - 1, int(len(durations) * 0.99))],
+        budget=1.0 / rate,
+        )
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--params", dest="params", type="int",
+                      default=1000, help="Modulated parameters [1000]")
+    parser.add_option("-v", "--voices", dest="voices", type="int",
+                      default=1, help="Synths per group [1]")
+    parser.add_option("-r", "--rate", dest="rate", type="float",
+                      default=100.0, help="Control rate in Hz [100]")
+    options, args = parser.parse_args()
+
+    stats = run(options.params, options.voices, rate=options.rate)
+    print '%(params)d params, %(voices)d voices per group' % stats
+    print 'tick mean %.3f ms, p99 %.3f ms, budget %.3f ms' % (
+        stats['mean'] * 1000, stats['p99'] * 1000, stats['budget'] * 1000)
+    if stats['p99'] > stats['budget']:
+        print 'FALLS BEHIND at %.0f Hz' % options.rate
+    else:
+        print 'keeps up at %.0f Hz' % options.rate
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Stand-ins for the SuperCollider server, the transport to it and MIDI
+sources, for use in benchmarks.
+"""
+
+import itertools
+import time
+
+from midi2sc import osc
+
+class StubServer(object):
+    """Records the time of each ``/s_new`` instead of sending it.
+    """
+    def __init__(self):
+        self.s_new_times = []
+
+    def sendMsg(self, *args):
+        if args[0] == '/s_new':
+            self.s_new_times.append(time.time())
+
+    def sendBundle(self, offset, messages):
+        pass
+
+    def receive(self, *args):
+        raise IOError("StubServer doesn't receive")
+
+class StubTransport(object):
+    """Encodes bundles like ``UDPTransport`` does, but only counts
+    them.
+    """
+    def __init__(self, max_size=1472):
+        self.max_size = max_size
+        self.encoder = osc.BundleEncoder()
+        self.datagrams = 0
+        self.bytes = 0
+
+    def send_bundle(self, when, messages):
+        for data in self.encoder.bundles(when, messages, self.max_size):
+            self.datagrams += 1
+            self.bytes += len(data)
+
+    def close(self):
+        pass
+
+class ReplayMidi(object):
+    """A MIDI source that endlessly repeats ``messages``.
+    """
+    def __init__(self, messages):
+        self.messages = itertools.cycle(messages)
+
+    def openPort(self, port, exclusive):
+        pass
+
+    def getPortName(self, port):
+        return 'replay'
+
+    def getMessage(self):
+        return self.messages.next()
+
+class ScheduledMidi(object):
+    """A MIDI source that emits a note-on and a note-off every
+    ``interval`` seconds, starting at ``start``.
+    """
+    def __init__(self, start, count, interval):
+        self.start = start
+        self.count = count
+        self.interval = interval
+        self.sent = 0
+
+    def openPort(self, port, exclusive):
+        pass
+
+    def getPortName(self, port):
+        return 'scheduled'
+
+    def getMessage(self):
+        if self.sent >= self.count * 2:
+            return None
+        due = self.start + self.sent * self.interval / 2
+        if time.time() < due:
+            return None
+        key = 36 + (self.sent // 2) % 48
+        if self.sent % 2:
+            message = (0x80, key, 0, due)
+        else:
+            message = (0x90, key, 100, due)
+        self.sent += 1
+        return message
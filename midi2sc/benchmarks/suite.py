@@ -0,0 +1,313 @@
+"""A suite of benchmarks of midi2sc's hot paths, with a stubbed server
+and MIDI source.
+
+Results are written as JSON with ``--output``; with ``--compare``, the
+results are checked against a baseline written earlier, and we exit
+with status 1 if any benchmark got slower by more than
+``--threshold`` plus the spread between the fastest and the slowest
+repetition of both runs::
+
+  $ python -m midi2sc.benchmarks.suite --output baseline.json
+  $ # ... change things
+  $ python -m midi2sc.benchmarks.suite --compare baseline.json
+
+Use ``--filter`` to run only benchmarks whose name contains a string.
+"""
+
+import gc
+import itertools
+import json
+import optparse
+import os
+import platform
+import StringIO
+import sys
+import tempfile
+import time
+
+from midi2sc import configure
+from midi2sc import control
+from midi2sc import core
+from midi2sc import gui
+from midi2sc.benchmarks import stubs
+
+FORMAT_VERSION = 2
+
+# Functions that clean up after a benchmark, see ``reset``:
+_cleanups = []
+
+def reset():
+    """Forget all synths, listeners and pending messages, and clean
+    up after the last benchmark.
+    """
+    core.Synth.synths.clear()
+    core.Synth.synths.event_listeners.clear()
+    del core.Synth.messages[:]
+    control.IncDecControl.group_values.clear()
+    while _cleanups:
+        _cleanups.pop()()
+
+def config_text(sections):
+    lines = []
+    for index in range(sections):
+        lines.extend([
+            '[Synth%d]' % index,
+            'midi_channel = %02d' % (index % 16 + 1),
+            'args = out=0',
+            '001 = amp_mul=   AbsoluteControl(min=0.0, max=1.27)',
+            '106 = mod_freq=  IDC(min=2.0, max=20.0, steps=50, value=2.0)',
+            '107 = mod_index= IDC(min=2.0, max=20.0, steps=50)',
+            '108 = decay=     IDC(min=0.05, max=1.0, steps=70)',
+            '',
+            ])
+    return '\n'.join(lines)
+
+def bench_config_read(sections):
+    text = config_text(sections)
+    def run():
+        reset()
+        configure.read(StringIO.StringIO(text))
+    return run
+
+def bench_dispatch():
+    group_ctrl = control.GroupControl(dict(
+        (key, control.AbsoluteControl('dispatch', param_name='p%d' % key))
+        for key in range(1, 9)))
+    handlers = {0xb0: group_ctrl}
+    midi = stubs.ReplayMidi([(0xb0, key, vel, 0.0)
+                             for key in range(1, 10) for vel in (0, 64)])
+    def run():
+        core.dispatch(handlers, midi.getMessage())
+    return run
+
+def _fanout(ctrl, voices, velocities):
+    for index in range(voices):
+        core.SCSynth('fanout', freq=440.0, amp=0.5)
+    velocities = itertools.cycle(velocities).next
+    messages = core.Synth.messages
+    def run():
+        ctrl(velocities(), 0.0)
+        del messages[:]
+    return run
+
+def bench_absolute_fanout(voices):
+    ctrl = control.AbsoluteControl('fanout', param_name='amp')
+    return _fanout(ctrl, voices, (0, 64, 127))
+
+def bench_idc_fanout(voices):
+    ctrl = control.IncDecControl('fanout', min=0.0, max=1.0, steps=100,
+                                 param_name='cutoff', value=0.5)
+    return _fanout(ctrl, voices, (1, 127))
+
+def bench_noteon_churn():
+    noteon = control.NoteOnControl('churn', out=0)
+    control.AbsoluteControl('churn', param_name='amp_mul')
+    handlers = {0x90: noteon, 0x80: control.NoteOffControl(noteon.notes)}
+    keys = range(48, 64)
+    midi = stubs.ReplayMidi([(0x90, key, 100, 0.0) for key in keys] +
+                            [(0x80, key, 0, 0.0) for key in keys])
+    messages = core.Synth.messages
+    def run():
+        core.dispatch(handlers, midi.getMessage())
+        del messages[:]
+    return run
+
+def bench_mpe_expression(fingers=10):
+    """Per-note pitch bend, pressure and timbre of ``fingers`` notes
+    held in an MPE zone.  Ten fingers each streaming all three at a few
+    hundred messages per second leave a budget of roughly 100 us per
+    message.
+    """
+    zone = control.MPEZone('mpe', out=0)
+    handlers = zone.handlers(range(2, 2 + fingers))
+    for finger in range(fingers):
+        core.dispatch(handlers, (0x91 + finger, 48 + finger * 3, 100, 0.0))
+    events = []
+    for value in range(0, 128, 8):
+        for finger in range(fingers):
+            events.extend([(0xe1 + finger, 0, value, 0.0),
+                           (0xd1 + finger, value, 0, 0.0),
+                           (0xb1 + finger, 74, value, 0.0)])
+    midi = stubs.ReplayMidi(events)
+    messages = core.Synth.messages
+    def run():
+        core.dispatch(handlers, midi.getMessage())
+        del messages[:]
+    return run
+
+class _MidiIn(object):
+    def __init__(self, handlers):
+        self.handlers = handlers
+
+def _presets(sections, voices):
+    midi_in = _MidiIn(configure.read(StringIO.StringIO(
+        config_text(sections))))
+    for index in range(sections):
+        for voice in range(voices):
+            core.SCSynth('Synth%d' % index, amp_mul=1.0)
+    fd, filename = tempfile.mkstemp(suffix='.pickle')
+    os.close(fd)
+    _cleanups.append(lambda: os.remove(filename))
+    core.save_presets(filename, midi_in)
+    return midi_in, filename
+
+def bench_save_presets(sections=16, voices=4):
+    midi_in, filename = _presets(sections, voices)
+    def run():
+        core.save_presets(filename, midi_in)
+    return run
+
+def bench_load_presets(sections=16, voices=4):
+    midi_in, filename = _presets(sections, voices)
+    messages = core.Synth.messages
+    def run():
+        core.load_presets(filename, midi_in)
+        del messages[:]
+    return run
+
+def bench_flush(count):
+    timer = core.MessagesTimer(0.001, stubs.StubTransport())
+    pending = [('/n_set', 2000 + index % 256, 'param%d' % (index % 8), 0.5)
+               for index in range(count)]
+    messages = core.Synth.messages
+    def run():
+        messages.extend(pending)
+        timer.flush()
+    return run
+
+def benchmarks():
+    """Return a list of ``(name, setup)`` pairs; calling ``setup``
+    returns the function to time.
+    """
+    p = lambda func, *args: lambda: func(*args)
+    cases = []
+    for sections in (10, 100, 1000):
+        cases.append(('config_read_%d' % sections,
+                      p(bench_config_read, sections)))
+    cases.append(('group_dispatch', bench_dispatch))
+    for voices in (1, 4, 16, 64, 256):
+        cases.append(('absolute_fanout_%d' % voices,
+                      p(bench_absolute_fanout, voices)))
+        cases.append(('idc_fanout_%d' % voices,
+                      p(bench_idc_fanout, voices)))
+    cases.append(('noteon_churn', bench_noteon_churn))
+    cases.append(('mpe_expression', bench_mpe_expression))
+    cases.append(('save_presets', bench_save_presets))
+    cases.append(('load_presets', bench_load_presets))
+    for count in (100, 1000, 10000):
+        cases.append(('flush_%d' % count, p(bench_flush, count)))
+    return cases
+
+def _time(func, number):
+    started = time.time()
+    for i in xrange(number):
+        func()
+    return time.time() - started
+
+def measure(func, min_time=0.2, repeat=3):
+    """Time ``func`` like ``timeit`` does and return the best time per
+    call, in seconds, the number of calls per repetition and the
+    spread, that is, how much slower the slowest repetition was than
+    the fastest one, relative to the fastest.
+    """
+    number = 1
+    while True:
+        elapsed = _time(func, number)
+        if elapsed >= min_time / repeat / 4 or number >= 1 << 20:
+            break
+        number *= 4
+    number = max(1, int(number * (min_time / repeat) / max(elapsed, 1e-9)))
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        times = [_time(func, number) for i in range(repeat)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+    best = min(times)
+    return best / number, number, max(times) / max(best, 1e-9) - 1.0
+
+def run(names=None, min_time=0.2, repeat=3, verbose=True):
+    gui.detach()
+    core.set_verbosity(0)
+    core.set_server(stubs.StubServer())
+
+    results = {}
+    for name, setup in benchmarks():
+        if names is not None and not [n for n in names if n in name]:
+            continue
+        reset()
+        per_call, number, spread = measure(setup(), min_time, repeat)
+        results[name] = dict(seconds=per_call, number=number, spread=spread)
+        if verbose:
+            print '%-24s %12.3f us %+7.1f%%' % (
+                name, per_call * 1e6, spread * 100)
+    reset()
+    return dict(
+        version=FORMAT_VERSION,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        time=time.time(),
+        results=results,
+        )
+
+def compare(baseline, current, threshold=0.25):
+    """Print a comparison of ``current`` against ``baseline`` results;
+    returns the names of benchmarks that got slower by more than
+    ``threshold`` plus the spread of both results.
+    """
+    regressions = []
+    print '%-24s %12s %12s %8s' % ('benchmark', 'baseline us', 'current us',
+                                    'change')
+    base_results = baseline['results']
+    for name in sorted(current['results']):
+        now = current['results'][name]['seconds']
+        if name not in base_results:
+            print '%-24s %12s %12.3f %8s' % (name, '-', now * 1e6, 'new')
+            continue
+        before = base_results[name]['seconds']
+        change = now / before - 1.0
+        allowed = (threshold + base_results[name].get('spread', 0.0) +
+                   current['results'][name]['spread'])
+        flag = ''
+        if change > allowed:
+            regressions.append(name)
+            flag = ' SLOWER'
+        print '%-24s %12.3f %12.3f %+7.1f%%%s' % (
+            name, before * 1e6, now * 1e6, change * 100, flag)
+    return regressions
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-o", "--output", dest="output", metavar="FILE",
+                      help="Write results as JSON to FILE")
+    parser.add_option("-c", "--compare", dest="compare", metavar="FILE",
+                      help="Compare results with baseline in FILE")
+    parser.add_option("-t", "--threshold", dest="threshold", type="float",
+                      default=0.25,
+                      help="Slowdown on top of the spread of both runs "
+                      "that counts as a regression [0.25]")
+    parser.add_option("-k", "--filter", dest="filters", action="append",
+                      metavar="STRING",
+                      help="Only run benchmarks whose name contains STRING")
+    parser.add_option("--min-time", dest="min_time", type="float",
+                      default=0.2,
+                      help="Seconds to spend timing each benchmark [0.2]")
+    options, args = parser.parse_args()
+
+    results = run(options.filters, options.min_time,
+                  verbose=not options.compare)
+    if options.output:
+        f = open(options.output, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+    if options.compare:
+        f = open(options.compare)
+        baseline = json.load(f)
+        f.close()
+        if compare(baseline, results, options.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
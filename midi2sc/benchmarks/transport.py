@@ -0,0 +1,108 @@
+"""Measure the throughput of the transports in ``midi2sc.transport``
+against a local sink, and how many messages actually arrive.
+
+Run it like so::
+
+  $ python -m midi2sc.benchmarks.transport --messages 50000 --bundle 500
+"""
+
+import optparse
+import socket
+import struct
+import threading
+import time
+
+from midi2sc import osc
+from midi2sc import transport
+
+class UDPSink(threading.Thread):
+    def __init__(self):
+        super(UDPSink, self).__init__()
+        self.setDaemon(True)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(0.5)
+        self.address = self.socket.getsockname()
+        self.packets = []
+
+    def run(self):
+        while True:
+            try:
+                self.packets.append(self.socket.recv(65536))
+            except socket.timeout:
+                break
+
+class TCPSink(threading.Thread):
+    def __init__(self):
+        super(TCPSink, self).__init__()
+        self.setDaemon(True)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(1)
+        self.address = self.socket.getsockname()
+        self.packets = []
+
+    def run(self):
+        connection, address = self.socket.accept()
+        chunks = []
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        data = ''.join(chunks)
+        index = 0
+        while index < len(data):
+            size = struct.unpack_from('>i', data, index)[0]
+            self.packets.append(data[index + 4:index + 4 + size])
+            index += 4 + size
+
+def run(name, sink, transport, messages, bundle):
+    sink.start()
+    batches = [messages[i:i + bundle]
+               for i in range(0, len(messages), bundle)]
+    started = time.time()
+    for batch in batches:
+        transport.send_bundle(None, batch)
+    elapsed = time.time() - started
+    transport.close()
+    sink.join()
+
+    received = sum(len(osc.decode(packet)) for packet in sink.packets)
+    size = sum(len(packet) for packet in sink.packets)
+    return dict(name=name, elapsed=elapsed, sent=len(messages),
+                received=received, packets=len(sink.packets),
+                rate=len(messages) / elapsed, bytes=size)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--messages", dest="messages", type="int",
+                      default=50000, help="Messages to send [50000]")
+    parser.add_option("-b", "--bundle", dest="bundle", type="int",
+                      default=500, help="Messages per bundle [500]")
+    options, args = parser.parse_args()
+
+    messages = [('/n_set', 2000 + i % 256, 'param%d' % (i % 8), 0.5)
+                for i in range(options.messages)]
+    results = []
+
+    sink = UDPSink()
+    results.append(run('udp', sink, transport.UDPTransport(sink.address),
+                       messages, options.bundle))
+
+    sink = UDPSink()
+    results.append(run('udp-64k', sink, transport.UDPTransport(
+        sink.address, max_size=65507), messages, options.bundle))
+
+    sink = TCPSink()
+    results.append(run('tcp', sink, transport.TCPTransport(sink.address),
+                       messages, options.bundle))
+
+    print '%-9s %9s %9s %8s %12s' % (
+        'transport', 'sent', 'received', 'packets', 'messages/s')
+    for result in results:
+        print '%(name)-9s %(sent)9d %(received)9d %(packets)8d ' \
+              '%(rate)12.0f' % result
+
+if __name__ == '__main__':
+    main()
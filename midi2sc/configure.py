@@ -4,12 +4,18 @@ import traceback
 
 from midi2sc import control
 from midi2sc import core # used inside an eval only
+from midi2sc import modulation
 
 handler_factories = dict(
     AbsoluteControl = control.AbsoluteControl,
     IDC = control.IncDecControl,
     )
 
+modulator_factories = dict(
+    LFO = modulation.LFO,
+    Envelope = modulation.Envelope,
+    )
+
 class ConfigurationError(Exception):
     pass
 
@@ -24,6 +30,60 @@ def _eval(string, reason=None):
         traceback.print_exc()
         raise ConfigurationError(msg)
 
+def _read_modulators(group, group_ctrl, modulators):
+    bases = dict((c.param_name, c) for c in group_ctrl.values())
+    result = []
+    for key in sorted(modulators.keys()):
+        param_name = key[len('mod.'):]
+        factory_name, func_params = modulators[key].split('(', 1)
+        factory_name = factory_name.strip()
+        if factory_name not in modulator_factories:
+            raise ConfigurationError(
+                "Unknown modulator '%s' for '%s'" % (factory_name, key))
+        kwargs = _eval("dict(%s" % func_params, key)
+        kwargs.setdefault('base', bases.get(param_name, 0.0))
+        try:
+            result.append(modulator_factories[factory_name](
+                group, param_name=param_name, **kwargs))
+        except (TypeError, ValueError), e:
+            raise ConfigurationError(
+                "Error while trying to process '%s': %s" % (key, e))
+    return result
+
+def _mpe_channels(group, kind, master, members):
+    """Return the member channels of an MPE zone whose master channel
+    is ``master``.  The lower zone's members count up from the master
+    channel, the upper zone's count down.
+    """
+    if kind == 'lower':
+        channels = range(master + 1, master + 1 + members)
+    elif kind == 'upper':
+        channels = range(master - 1, master - 1 - members, -1)
+    else:
+        raise ConfigurationError(
+            "Unknown MPE zone '%s' in [%s]; use 'lower' or 'upper'" % (
+                kind, group))
+    if not members or min(channels) < 1 or max(channels) > 16:
+        raise ConfigurationError(
+            "[%s]: %d member channels don't fit the %s zone of master "
+            "channel %d" % (group, members, kind, master))
+    return channels
+
+def _add_handlers(handlers, owners, group, new, mpe=False):
+    """Add the handlers ``new`` of section ``group`` to ``handlers``.
+    MPE member channels can't be shared with other sections, and
+    ``owners`` remembers which section took which MIDI status.
+    """
+    for status in sorted(new.keys()):
+        owner, owner_mpe = owners.get(status, (None, False))
+        if owner is not None and (mpe or owner_mpe):
+            raise ConfigurationError(
+                "[%s]: MIDI channel %d is already taken by [%s]" % (
+                    group, (status & 0x0f) + 1, owner))
+    handlers.update(new)
+    for status in new:
+        owners[status] = (group, mpe)
+
 def read(f):
     if isinstance(f, (str, unicode)):
         fp = open(f)
@@ -36,6 +96,7 @@ def read(f):
     contents = f.read()
 
     handlers = {}
+    owners = {}
 
     sections = sorted(parser.sections(),
                       key=lambda s: contents.index('[%s]' % s))
@@ -46,8 +107,20 @@ def read(f):
         args = options.pop('args', '')
         args = args.replace('in=', 'in_=') # ugh!
         noteon = options.pop('noteon', 'true').lower() in ('true', '1', 't')
+        mpe = options.pop('mpe', '').lower()
+        mpe_options = dict(
+            members=int(options.pop('mpe_members', 15)),
+            bend_range=float(options.pop('mpe_bend_range', 48)),
+            pressure_param=options.pop('mpe_pressure', 'pressure'),
+            timbre_param=options.pop('mpe_timbre', 'timbre'),
+            )
+
+        modulators = dict((key, options.pop(key)) for key in options.keys()
+                          if key.startswith('mod.'))
 
-        handlers[0xb0 + midi_channel-1] = group_ctrl = control.GroupControl({})
+        group_ctrl = control.GroupControl({})
+        _add_handlers(handlers, owners, group,
+                      {0xb0 + midi_channel-1: group_ctrl})
         controls = {}
 
         for key in sorted(options.keys()):
@@ -59,12 +132,27 @@ def read(f):
                 handler_name, group, param_name, func_params), key)
             group_ctrl[key] = handler
 
-        if noteon:
+        if modulators:
+            group_ctrl.modulators = _read_modulators(
+                group, group_ctrl, modulators)
+        # These replace the modulators that the group had before:
+        modulation.set_modulators(group, group_ctrl.modulators)
+
+        if mpe:
+            channels = _mpe_channels(
+                group, mpe, midi_channel, mpe_options.pop('members'))
+            zone = _eval("control.MPEZone(%r, %s)" % (
+                group, ', '.join(['%s=%r' % item for item in
+                                  mpe_options.items()] + [args])))
+            _add_handlers(handlers, owners, group, zone.handlers(channels),
+                          mpe=True)
+        elif noteon:
             noteon_ctrl = _eval(
                 "control.NoteOnControl(%r, %s)" % (group, args))
             noteoff_ctrl = control.NoteOffControl(noteon_ctrl.notes)
-            handlers[0x90 + midi_channel-1] = noteon_ctrl
-            handlers[0x80 + midi_channel-1] = noteoff_ctrl
+            _add_handlers(handlers, owners, group,
+                          {0x90 + midi_channel-1: noteon_ctrl,
+                           0x80 + midi_channel-1: noteoff_ctrl})
         else:
             _eval("core.SCSynth(%r, %s)" % (group, args))
 
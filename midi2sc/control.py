@@ -6,9 +6,65 @@ from midi2sc import gui
 
 _empty = object()
 
+def controls_by_param(handlers):
+    """Return all controls in ``handlers`` that have a value, keyed by
+    ``(group, param_name)``.
+    """
+    controls = {}
+    for handler in handlers.values():
+        if isinstance(handler, GroupControl):
+            for control in handler.values():
+                if hasattr(control, 'update_value'):
+                    controls[(control.group, control.param_name)] = control
+    return controls
+
+def _admit(voices, steal, forget=None):
+    """Ask the load monitor whether we may start a new voice; if it
+    says so, call ``steal`` with the key of the oldest one of
+    ``voices``.
+
+    Voices whose synths the server has freed already are dropped
+    first, through ``forget`` if given, so that they neither count
+    as playing nor get stolen:
+
+      >>> class Monitor(object):
+      ...     def voice_policy(self, playing):
+      ...         print 'playing:', playing
+      ...         return 'steal'
+      >>> core.set_load_monitor(Monitor())
+      >>> control = NoteOnControl('admit-group', synthfactory=core.Synth)
+      >>> control(60, 127, None)
+      playing: 0
+      >>> control(62, 127, None)
+      playing: 1
+      >>> sorted(control.notes)
+      [62]
+      >>> control.notes[62].ended = True
+      >>> control(64, 127, None)
+      playing: 0
+      >>> sorted(control.notes)
+      [64]
+      >>> core.set_load_monitor(None)
+    """
+    monitor = core.get_load_monitor()
+    if monitor is None:
+        return True
+    for key in [key for key, synth in voices.items() if synth.ended]:
+        if forget is None:
+            del voices[key]
+        else:
+            forget(key)
+    policy = monitor.voice_policy(len(voices))
+    if policy == 'steal' and voices:
+        steal(min(voices, key=lambda key: voices[key].id))
+    return policy != 'refuse'
+
 class GroupControl(dict):
-    """Group controls by key.
+    """Group controls by key.  ``modulators`` are the LFOs and
+    envelopes of the group, see ``midi2sc.modulation``.
     """
+    modulators = ()
+
     def __init__(self, controls):
         super(GroupControl, self).__init__()
         self.update(controls)
@@ -37,7 +93,13 @@ class NoteOnControl(object):
     def __call__(self, key, vel, timestamp):
         notes = self.notes
         synth = notes.get(key)
+        if synth is not None and synth.ended:
+            # The server has freed the synth already:
+            del notes[key]
+            synth = None
         if vel and synth is None:
+            if not self.admit():
+                return
             freq = 440 * 2 ** ((key - 69) / 12.)
             notes[key] = self.synthfactory(
                 self.group, freq=freq, amp=vel/127., **self.params)
@@ -46,6 +108,14 @@ class NoteOnControl(object):
             synth.remove()
             del notes[key]
 
+    def admit(self):
+        return _admit(self.notes, self.steal)
+
+    def steal(self, key):
+        synth = self.notes.pop(key)
+        synth['gate'] = 0
+        synth.remove()
+
     def __repr__(self):
         return '<NoteOnControl group=%r, params=%s>' % (
             self.group, pprint.pformat(self.params))
@@ -82,8 +152,13 @@ class NoteOnParam(object):
         if vel == 0.0:
             return
         key_val, vel_val = self.compute_values(key, vel)
-        for synth in core.Synth.synths[self.group].values():
-            self.set_params_for(synth, key_val, vel_val)
+        synths = core.Synth.synths[self.group]
+        messages = []
+        if key_val is not None:
+            messages.extend(synths.assign(self.key_param, key_val))
+        if vel_val is not None:
+            messages.extend(synths.assign(self.vel_param, vel_val))
+        core.queue_messages(messages)
 
     def set_params_for(self, synth, key_val=_empty, vel_val=_empty):
         if key_val is _empty:
@@ -105,7 +180,23 @@ class NoteOnParam(object):
         return '<NoteOnParam key_param=%r vel_param=%r>' % (
             self.key_param, self.vel_param)
 
-class AbsoluteControl(object):
+class Watched(object):
+    """Mixin for controls that call the functions passed to ``watch``
+    with themselves whenever their value changes.
+    """
+    watchers = ()
+
+    def watch(self, func):
+        self.watchers = list(self.watchers) + [func]
+
+    def unwatch(self, func):
+        self.watchers = [f for f in self.watchers if f != func]
+
+    def changed(self):
+        for func in self.watchers:
+            func(self)
+
+class AbsoluteControl(Watched):
     """A MIDI control that sets values between min and max.
     """
     def __init__(self, group,
@@ -124,16 +215,21 @@ class AbsoluteControl(object):
 
     def __call__(self, vel, timestamp):
         self.vel = vel
-        value = self.value
-        for synth in core.Synth.synths[self.group].values():
-            self.set_params_for(synth, value=value)
-        self.vel = vel
+        self.changed()
+        core.queue_messages(self.set_params_for_group(
+            core.Synth.synths[self.group], self.value))
         gui.update(self, vel)
 
     def set_params_for(self, synth, value=None):
         value = self.value if value is None else value
         synth[self.param_name] = value
 
+    def set_params_for_group(self, synths, value):
+        """Set our parameter for all ``synths`` of the group at once;
+        returns the messages to send.
+        """
+        return synths.assign(self.param_name, value)
+
     @property
     def value(self):
         val = (self.vel / self.div) + self.min
@@ -141,17 +237,23 @@ class AbsoluteControl(object):
 
     def update_value(self, value):
         gui.disable_updates() # wee!!
-        self((value * self.div) + self.min, None)
+        self((value - self.min) * self.div, None)
         gui.enable_updates()
 
     def __repr__(self):
         return "<%s for %r param %r>" % (
             self.__class__.__name__, self.group, self.param_name)
 
+    def __getstate__(self):
+        # Watchers are attached again after loading:
+        state = dict(self.__dict__)
+        state.pop('watchers', None)
+        return state
+
     def __del__(self):
-        core.Synth.synths.event_listeners[self.group].remove(self)
+        core.Synth.synths.event_listeners[self.group].discard(self)
 
-class IncDecControl(object):
+class IncDecControl(Watched):
     """A MIDI control for endless dial data
     """
     group_values = {}
@@ -186,6 +288,7 @@ class IncDecControl(object):
             return self.group_values.get(_key(self))
         def set(self, value):
             self.group_values[_key(self)] = value
+            self.changed()
         return property(get, set)
 
     def update_value(self, value):
@@ -203,36 +306,34 @@ class IncDecControl(object):
             step = vel * self.step
 
         param_name = self.param_name
-        sticky = self.sticky
-        next_value = None
+        synths = core.Synth.synths[self.group]
+
+        if not self.sticky:
+            # If we're not sticky, we'll just add whatever step to the
+            # existing value of the parameter of each synth:
+            messages = synths.shift(param_name, step, self.min, self.max)
+            if messages:
+                self.check_range(messages[-1][3])
+            core.queue_messages(messages)
+            return
+
         value = self.value
-        
-        for synth in core.Synth.synths[self.group].values():
-            if next_value is None:
-                if sticky and value is None:
-                    # We're sticky, so we're supposed to keep a value
-                    # around that we can apply at set_params_for time:
-                    try:
-                        self.value = value = synth[param_name]
-                    except KeyError:
-                        continue
-                if sticky:
-                    # We can calculate the parameter's next value
-                    # using self.value if we're sticky:
-                    next_value = self.value + step
-                else:
-                    # If we're not sticky, we'll just add whatever
-                    # step to the existing value of the parameter of
-                    # the synth:
-                    next_value = synth[param_name] + step
-                next_value = self.check_range(next_value)
-
-            synth[self.param_name] = next_value
-
-        if sticky and next_value is not None:
-            self.value = next_value
-        elif sticky and self.value is not None:
-            self.value = self.check_range(self.value + step)
+        if value is None:
+            # We're sticky, so we're supposed to keep a value around
+            # that we can apply at set_params_for time:
+            for synth in synths.values():
+                try:
+                    value = synth[param_name]
+                    break
+                except KeyError:
+                    continue
+            else:
+                return
+
+        # We can calculate the parameter's next value using
+        # self.value if we're sticky:
+        self.value = next_value = self.check_range(value + step)
+        core.queue_messages(synths.assign(param_name, next_value))
 
     def set_params_for(self, synth):
         if self.sticky and self.value is not None:
@@ -287,9 +388,12 @@ class RelativeControl(AbsoluteControl):
 
     def set_params_for(self, synth, value=None):
         param_name = self.param_name
-        value = self.value() if value is None else value
+        value = self.value if value is None else value
         synth[param_name] = synth.params_orig[param_name] * value
 
+    def set_params_for_group(self, synths, value):
+        return synths.scale(self.param_name, value)
+
 class AfterTouch(RelativeControl):
     def __init__(self, group,
                  min=1.0, max=1.5, start_vel=0, param_name='amp'):
@@ -298,3 +402,163 @@ class AfterTouch(RelativeControl):
     def __call__(self, vel, timestamp):
         super(AfterTouch, self).__call__(vel, timestamp)
 
+class MPEZone(object):
+    """Plays the notes of an MPE (MIDI Polyphonic Expression) zone.
+
+    In MPE, every note is played on a member channel of its own, and
+    that channel's pitch bend, channel pressure and CC 74 (timbre)
+    apply to that note only.  We keep the synth that each member
+    channel plays, so that per-note expression turns into one
+    ``/n_set`` on that synth, no matter how many voices are playing:
+
+      >>> zone = MPEZone('mpe-group', synthfactory=core.Synth)
+      >>> zone.note_on(2, 69, 127)
+      >>> zone.note_on(3, 72, 127)
+      >>> zone.pitch_bend(2, 0, 96) # up by a quarter of 48 semitones
+      >>> round(zone.voices[2]['freq'], 2), round(zone.voices[3]['freq'], 2)
+      (1760.0, 523.25)
+      >>> zone.pressure(3, 127)
+      >>> zone.voices[3]['pressure']
+      1.0
+      >>> zone.note_off(2, 69, 0)
+      >>> sorted(zone.voices.keys())
+      [3]
+
+    While the server is overloaded, a new note may steal the oldest
+    voice, and its member channel is free again:
+
+      >>> class Monitor:
+      ...     def voice_policy(self, playing):
+      ...         return 'steal'
+      >>> core.set_load_monitor(Monitor())
+      >>> zone.note_on(4, 60, 127)
+      >>> sorted(zone.voices.keys()), sorted(zone.keys.keys())
+      ([4], [4])
+      >>> core.set_load_monitor(None)
+
+    Pitch bend, pressure and timbre received before a note starts are
+    applied to the new synth right away.
+    """
+    def __init__(self, group, synthfactory=None, bend_range=48,
+                 pitch_param='freq', pressure_param='pressure',
+                 timbre_param='timbre', **kwargs):
+        self.group = group
+        if synthfactory is None:
+            synthfactory = core.SCSynth
+        self.synthfactory = synthfactory
+        self.bend_range = bend_range
+        self.pitch_param = pitch_param
+        self.pressure_param = pressure_param
+        self.timbre_param = timbre_param
+        self.params = kwargs
+        self.voices = {}   # channel -> synth
+        self.keys = {}     # channel -> key
+        self.bends = {}    # channel -> semitones
+        self.expression = {} # channel -> {param: value}
+
+    def _freq(self, channel, key):
+        semitones = key + self.bends.get(channel, 0.0) - 69
+        return 440 * 2 ** (semitones / 12.)
+
+    def note_on(self, channel, key, vel, *args):
+        if vel == 0:
+            return self.note_off(channel, key, vel)
+        if channel in self.voices:
+            # Only one note per member channel:
+            self.note_off(channel, self.keys[channel], 0)
+        if not _admit(self.voices, self.steal, self.forget):
+            return
+        params = dict(self.params)
+        params.update(self.expression.get(channel, {}))
+        params[self.pitch_param] = self._freq(channel, key)
+        params.setdefault('amp', vel/127.)
+        self.voices[channel] = self.synthfactory(self.group, **params)
+        self.keys[channel] = key
+
+    def steal(self, channel):
+        self.note_off(channel, self.keys[channel], 0)
+
+    def forget(self, channel):
+        """Drop the voice of ``channel``, whose synth has ended."""
+        del self.voices[channel]
+        del self.keys[channel]
+
+    def note_off(self, channel, key, vel, *args):
+        synth = self.voices.get(channel)
+        if synth is not None and self.keys[channel] == key:
+            del self.voices[channel]
+            del self.keys[channel]
+            synth['gate'] = 0
+            synth.remove()
+
+    def pitch_bend(self, channel, lsb, msb, *args):
+        self.bends[channel] = (
+            ((msb << 7) | lsb) - 8192) / 8192. * self.bend_range
+        synth = self.voices.get(channel)
+        if synth is not None:
+            synth[self.pitch_param] = self._freq(channel, self.keys[channel])
+
+    def _express(self, channel, param_name, value):
+        if param_name is None:
+            return
+        self.expression.setdefault(channel, {})[param_name] = value
+        synth = self.voices.get(channel)
+        if synth is not None:
+            synth[param_name] = value
+
+    def pressure(self, channel, value, *args):
+        self._express(channel, self.pressure_param, value / 127.)
+
+    def timbre(self, channel, value, *args):
+        self._express(channel, self.timbre_param, value / 127.)
+
+    def all_notes_off(self):
+        for channel, key in self.keys.items():
+            self.note_off(channel, key, 0)
+
+    def handlers(self, channels):
+        """Return the MIDI handlers for member ``channels``, keyed by
+        MIDI command.
+        """
+        handlers = {}
+        for channel in channels:
+            status = channel - 1
+            handlers[0x90 + status] = MPEHandler(self, channel, 'note_on')
+            handlers[0x80 + status] = MPEHandler(self, channel, 'note_off')
+            handlers[0xe0 + status] = MPEHandler(self, channel, 'pitch_bend')
+            handlers[0xd0 + status] = MPEHandler(self, channel, 'pressure')
+            handlers[0xb0 + status] = GroupControl(
+                {74: MPEHandler(self, channel, 'timbre')})
+        return handlers
+
+    def __getstate__(self):
+        # Notes are turned off before presets are saved:
+        state = dict(self.__dict__)
+        state.update(voices={}, keys={})
+        return state
+
+    def __repr__(self):
+        return '<MPEZone group=%r, params=%s>' % (
+            self.group, pprint.pformat(self.params))
+
+class MPEHandler(object):
+    """Passes MIDI messages of one member channel on to an MPEZone's
+    method ``name``.
+    """
+    def __init__(self, zone, channel, name):
+        self.zone = zone
+        self.channel = channel
+        self.name = name
+        self.method = getattr(zone, name)
+
+    def __call__(self, *args):
+        self.method(self.channel, *args)
+
+    def __getstate__(self):
+        return (self.zone, self.channel, self.name)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return '<MPEHandler %s channel=%d>' % (self.name, self.channel)
@@ -4,12 +4,18 @@ import logging
 import operator
 import optparse
 import pickle
+import socket
 import threading
+import time
 import traceback
 
+import numpy
 import rtmidi
 import scosc
 
+from midi2sc import osc
+from midi2sc import transport as transports
+
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger('midi2sc')
 
@@ -27,8 +33,41 @@ def set_server(value):
 def get_server():
     return _state['server']
 
+def set_load_monitor(value):
+    _state['load_monitor'] = value
+
+def get_load_monitor():
+    return _state.get('load_monitor')
+
 server_lock = threading.Lock()
 
+_batch = threading.local()
+
+def begin_batch():
+    """Hold back all ``/n_set`` messages of the current thread until
+    ``end_batch`` is called, so that they go out in one bundle.
+    """
+    _batch.messages = []
+
+def end_batch():
+    queue_messages(_batch.__dict__.pop('messages', ()))
+
+def queue_messages(messages):
+    """Queue ``messages`` to be sent by the ``MessagesTimer``, taking
+    the ``server_lock`` only once.
+    """
+    if not messages:
+        return
+    batch = getattr(_batch, 'messages', None)
+    if batch is not None:
+        batch.extend(messages)
+        return
+    try:
+        server_lock.acquire()
+        Synth.messages.extend(messages)
+    finally:
+        server_lock.release()
+
 class KeyErrorLessDict(dict):
     def __init__(self, prototype):
         self.prototype = prototype
@@ -38,28 +77,382 @@ class KeyErrorLessDict(dict):
             self[key] = copy.copy(self.prototype)
         return super(KeyErrorLessDict, self).__getitem__(key)
 
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return numpy.nan
+
+class ParamStore(object):
+    """Parameters of the synths of one group, stored in columns.
+
+    There's one row per synth and one column per parameter.  A column
+    is created the first time that a parameter is set for the whole
+    group; rows of synths that don't have the parameter are NaN, and
+    they're skipped when setting values.  For parameters that have a
+    column, the store holds the current values, and a synth reads
+    them from here; its own dict is only brought up to date when it's
+    removed:
+
+      >>> store = ParamStore()
+      >>> synths = [Synth('store-group', freq=f) for f in (100, 200)]
+      >>> store.add(synths[0]); store.add(synths[1])
+      >>> messages = store.scale('freq', 1.5)
+      >>> [synth['freq'] for synth in synths]
+      [150.0, 300.0]
+      >>> len(messages)
+      2
+      >>> dict.get(synths[1], 'freq'), synths[1]['freq']
+      (200, 300.0)
+      >>> store.remove(synths[0].id)
+      >>> dict.get(synths[0], 'freq')
+      150.0
+      >>> store.assign('amp', 0.5) == [('/n_set', synths[1].id, 'amp', 0.5)]
+      True
+    """
+    def __init__(self, capacity=8):
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        self.size = 0
+        self.synths = []
+        self.rows = {}
+        self.ids = numpy.zeros(capacity, dtype=int)
+        self.columns = {}
+        self.originals = {}
+
+    def _grow(self):
+        self.capacity *= 2
+        ids = numpy.zeros(self.capacity, dtype=int)
+        ids[:self.size] = self.ids[:self.size]
+        self.ids = ids
+        for columns in (self.columns, self.originals):
+            for name, column in columns.items():
+                new = numpy.empty(self.capacity)
+                new.fill(numpy.nan)
+                new[:self.size] = column[:self.size]
+                columns[name] = new
+
+    def add(self, synth):
+        try:
+            self.lock.acquire()
+            if self.size == self.capacity:
+                self._grow()
+            row = self.size
+            self.rows[synth.id] = row
+            self.synths.append(synth)
+            self.ids[row] = synth.id
+            synth.store = self
+            for name, column in self.columns.items():
+                column[row] = _float(dict.get(synth, name))
+            for name, column in self.originals.items():
+                column[row] = _float(synth.params_orig.get(name))
+            self.size += 1
+        finally:
+            self.lock.release()
+
+    def remove(self, id):
+        try:
+            self.lock.acquire()
+            row = self.rows.pop(id, None)
+            if row is None:
+                return
+            synth = self.synths[row]
+            synth.store = None
+            for name, column in self.columns.items():
+                value = column[row]
+                if value == value: # not NaN
+                    dict.__setitem__(synth, name, float(value))
+            # Move the last row into the gap:
+            last = self.size - 1
+            if row != last:
+                synth = self.synths[row] = self.synths[last]
+                self.rows[synth.id] = row
+                self.ids[row] = self.ids[last]
+                for columns in (self.columns, self.originals):
+                    for column in columns.values():
+                        column[row] = column[last]
+            self.synths.pop()
+            self.size -= 1
+        finally:
+            self.lock.release()
+
+    def _column(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = numpy.empty(self.capacity)
+            column.fill(numpy.nan)
+            column[:self.size] = [_float(dict.get(synth, name))
+                                  for synth in self.synths]
+        return column
+
+    def _original(self, name):
+        column = self.originals.get(name)
+        if column is None:
+            column = self.originals[name] = numpy.empty(self.capacity)
+            column.fill(numpy.nan)
+            column[:self.size] = [_float(synth.params_orig.get(name))
+                                  for synth in self.synths]
+        return column
+
+    def get(self, synth, name):
+        """Return a single synth's parameter, or ``None`` if we don't
+        know it.
+        """
+        try:
+            self.lock.acquire()
+            row = self.rows.get(synth.id)
+            column = self.columns.get(name)
+            if row is not None and column is not None:
+                value = column[row]
+                if value == value: # not NaN
+                    return float(value)
+        finally:
+            self.lock.release()
+
+    def update(self, synth, name, value):
+        """Reflect a single synth's parameter change.
+        """
+        try:
+            self.lock.acquire()
+            row = self.rows.get(synth.id)
+            column = self.columns.get(name)
+            if row is not None and column is not None:
+                column[row] = _float(value)
+        finally:
+            self.lock.release()
+
+    def update_many(self, changes):
+        """Reflect changes of single synths' parameters, given as a
+        list of ``(id, name, value)``.
+        """
+        try:
+            self.lock.acquire()
+            rows, columns = self.rows, self.columns
+            for id, name, value in changes:
+                row = rows.get(id)
+                if row is None:
+                    continue
+                column = columns.get(name)
+                if column is not None:
+                    column[row] = value
+                else:
+                    dict.__setitem__(self.synths[row], name, value)
+        finally:
+            self.lock.release()
+
+    def missing(self, name):
+        """Return the synths that we don't know parameter ``name`` of.
+        """
+        try:
+            self.lock.acquire()
+            column = self._column(name)[:self.size]
+            return [self.synths[row]
+                    for row in numpy.flatnonzero(numpy.isnan(column))]
+        finally:
+            self.lock.release()
+
+    def assign(self, name, value):
+        """Set parameter ``name`` of all synths to ``value``; returns
+        the ``/n_set`` messages to send.
+        """
+        try:
+            self.lock.acquire()
+            column = self._column(name)
+            column[:self.size] = value
+            return self._changes(name, column)
+        finally:
+            self.lock.release()
+
+    def assign_many(self, items):
+        """Like ``assign``, but for a list of ``(name, value)`` pairs.
+        """
+        try:
+            self.lock.acquire()
+            n = self.size
+            columns = self.columns
+            for name, value in items:
+                column = columns.get(name)
+                if column is None:
+                    column = self._column(name)
+                column[:n] = value
+            ids = self.ids[:n].tolist()
+            return [('/n_set', id, name, value)
+                    for name, value in items for id in ids]
+        finally:
+            self.lock.release()
+
+    def scale(self, name, factor):
+        """Set parameter ``name`` of all synths to their original
+        value multiplied by ``factor``.
+        """
+        try:
+            self.lock.acquire()
+            column = self._column(name)
+            n = self.size
+            column[:n] = self._original(name)[:n] * factor
+            return self._changes(name, column)
+        finally:
+            self.lock.release()
+
+    def shift(self, name, step, low=None, high=None):
+        """Add ``step`` to parameter ``name`` of all synths, keeping
+        values between ``low`` and ``high``.
+        """
+        try:
+            self.lock.acquire()
+            column = self._column(name)
+            n = self.size
+            values = column[:n] + step
+            if low is not None or high is not None:
+                values = numpy.clip(values,
+                                    -numpy.inf if low is None else low,
+                                    numpy.inf if high is None else high)
+            column[:n] = values
+            return self._changes(name, column)
+        finally:
+            self.lock.release()
+
+    def _changes(self, name, column):
+        # Messages for all synths that have a value:
+        n = self.size
+        values, ids = column[:n], self.ids[:n]
+        known = values == values # not NaN
+        if not known.all():
+            values, ids = values[known], ids[known]
+        count = len(ids)
+        return zip(['/n_set'] * count, ids.tolist(), [name] * count,
+                   values.tolist())
+
 class DispatchingDict(dict):
     """Event dispatching dict that's used by SynthRegistry.
+
+    Listeners are told about each synth that's added through their
+    ``set_params_for`` method, and about each synth that's removed
+    through ``synth_removed``, if they have one.
+
+    Its ``store`` keeps the parameters of all synths in the group in
+    columns.  Use ``assign``, ``scale`` and ``shift`` to change one
+    parameter of all synths at once; these return the ``/n_set``
+    messages to pass to ``queue_messages``.
     """
-    def __init__(self, listeners):
+    def __init__(self, listeners, stats):
         super(DispatchingDict, self).__init__()
         self.listeners = listeners
+        self.stats = stats
+        # Ids of synths that the server told us have ended, but whose
+        # notes are still held:
+        self.ended = set()
+        self.store = ParamStore()
 
     def __setitem__(self, id, synth):
         super(DispatchingDict, self).__setitem__(id, synth)
         for handler in self.listeners[synth.group]:
             handler.set_params_for(synth)
+        self.store.add(synth)
+
+    def __delitem__(self, id):
+        self.pop(id)
+
+    def pop(self, id, *default):
+        synth = super(DispatchingDict, self).pop(id, *default)
+        self.store.remove(id)
+        if isinstance(synth, Synth):
+            for handler in self.listeners[synth.group]:
+                removed = getattr(handler, 'synth_removed', None)
+                if removed is not None:
+                    removed(synth)
+        return synth
+
+    def _fanout(self):
+        # Had we not pruned the synths that the server told us have
+        # ended, we'd be sending one message to each of them:
+        self.stats['n_set_avoided'] += len(self.ended)
+
+    def assign(self, name, value):
+        self._fanout()
+        return self.store.assign(name, value)
+
+    def assign_many(self, items):
+        self._fanout()
+        return self.store.assign_many(items)
+
+    def scale(self, name, factor):
+        self._fanout()
+        return self.store.scale(name, factor)
+
+    def shift(self, name, step, low=None, high=None):
+        self._fanout()
+        for synth in self.store.missing(name):
+            # This may ask the server for the value:
+            try:
+                synth[name]
+            except KeyError:
+                pass
+        return self.store.shift(name, step, low, high)
 
 class SynthRegistry(dict):
+    """The registry of all synths that are playing, keyed by group.
+
+    If we're connected to a ``ServerListener``, the server notifies
+    us about every node that ends, like synths that free themselves
+    through a done action, and we prune these from the registry:
+
+      >>> synths = SynthRegistry()
+      >>> synth = Synth('my-group')
+      >>> synths['my-group'][synth.id] = synth
+      >>> synths.node_ended(synth.id, 1, -1, -1, 0)
+      >>> synths['my-group'].values(), synth.alive
+      ([], False)
+      >>> synths.stats['pruned']
+      1
+
+    Until its note is removed, which ``Synth.remove`` takes care of,
+    each change to all synths in the group counts as an ``/n_set``
+    that we avoided sending:
+
+      >>> synths['my-group'].assign('amp', 0.5)
+      []
+      >>> synths.stats['n_set_avoided']
+      1
+      >>> synths['my-group'].ended.discard(synth.id)
+      >>> synths['my-group'].assign('amp', 0.5)
+      []
+      >>> synths.stats['n_set_avoided']
+      1
+    """
     def __init__(self):
         super(SynthRegistry, self).__init__()
         self.event_listeners = KeyErrorLessDict(set())
+        self.stats = dict(n_go=0, n_end=0, pruned=0, n_set_avoided=0)
 
     def __getitem__(self, key):
         if key not in self:
-            self[key] = DispatchingDict(self.event_listeners)
+            self[key] = DispatchingDict(self.event_listeners, self.stats)
         return super(SynthRegistry, self).__getitem__(key)
 
+    def node_started(self, id, *args):
+        """Handles scsynth's ``/n_go`` notification.
+        """
+        self.stats['n_go'] += 1
+
+    def node_ended(self, id, *args):
+        """Handles scsynth's ``/n_end`` notification.
+        """
+        self.stats['n_end'] += 1
+        for synths in self.values():
+            synth = synths.get(id)
+            if synth is not None:
+                synth.alive = False
+                synth.ended = True
+                synths.pop(id)
+                synths.ended.add(id)
+                self.stats['pruned'] += 1
+                break
+        else:
+            # A released synth may still have envelopes running:
+            from midi2sc import modulation
+            modulation.drop_synth(id)
+
     def set_params_for_all(self):
         for group, synths in self.items():
             for handler in self.event_listeners[group]:
@@ -102,6 +495,19 @@ class Synth(dict):
       >>> Synth('my-group', frequency=440).params_orig
       {'frequency': 440}
 
+    Parameters that have been set for the whole group live in the
+    group's ``ParamStore`` (see there).  Item access, ``get``,
+    ``items``, ``values``, ``copy`` and ``repr`` read them from the
+    store; ``dict(synth)`` doesn't, so use ``synth.copy()`` instead:
+
+      >>> synth = Synth('view-group', freq=440)
+      >>> messages = Synth.synths['view-group'].assign('freq', 220.0)
+      >>> synth.get('freq'), synth.items(), synth.values()
+      (220.0, [('freq', 220.0)], [220.0])
+      >>> synth.copy(), synth
+      ({'freq': 220.0}, {'freq': 220.0})
+      >>> synth.remove().copy() == dict(synth)
+      True
     """
     # Commonly used by all subclasses of Synth
     synths = SynthRegistry()
@@ -111,6 +517,12 @@ class Synth(dict):
 
     alive = False
 
+    # True if the server told us that this synth has ended
+    ended = False
+
+    # The ``ParamStore`` of our group while we're in the registry
+    store = None
+
     def int_pool(start=2000):
         while True:
             yield start
@@ -126,8 +538,51 @@ class Synth(dict):
         Synth.synths[group][id] = self
         self.alive = True
 
+    def __getitem__(self, key):
+        store = self.store
+        if store is not None and key in store.columns:
+            value = store.get(self, key)
+            if value is not None:
+                return value
+        return super(Synth, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def __setitem__(self, key, value):
+        super(Synth, self).__setitem__(key, value)
+        store = self.store
+        # Only parameters that are set for the whole group have a
+        # column:
+        if store is not None and key in store.columns:
+            store.update(self, key, value)
+
     def remove(self):
-        del self.synths[self.group][self.id]
+        # The synth may have been pruned already, see
+        # ``SynthRegistry.node_ended``:
+        synths = self.synths[self.group]
+        synths.pop(self.id, None)
+        synths.ended.discard(self.id)
         self.alive = False
         return self
 
@@ -160,11 +615,9 @@ class SCSynth(Synth):
     def __setitem__(self, key, value):
         super(SCSynth, self).__setitem__(key, value)
         if self.alive:
-            try:
-                server_lock.acquire()
-                self.messages.append(('/n_set', self.id, key, value))
-            finally:
-                server_lock.release()
+            queue_messages([('/n_set', self.id, key, value)])
+        elif self.ended:
+            self.synths.stats['n_set_avoided'] += 1
 
     def __getitem__(self, key):
         try:
@@ -186,32 +639,356 @@ class SCSynth(Synth):
             else:
                 raise KeyError(key)
 
+def coalesce(messages):
+    """Drop all ``/n_set`` messages that a later message for the same
+    node and parameter overrides:
+
+      >>> coalesce([('/n_set', 1, 'amp', 0.1), ('/n_set', 1, 'freq', 440),
+      ...           ('/n_set', 1, 'amp', 0.2), ('/n_free', 2)])
+      [('/n_set', 1, 'freq', 440), ('/n_set', 1, 'amp', 0.2), ('/n_free', 2)]
+    """
+    seen = set()
+    result = []
+    for message in reversed(messages):
+        if message[0] == '/n_set':
+            key = message[1:3]
+            if key in seen:
+                continue
+            seen.add(key)
+        result.append(message)
+    result.reverse()
+    return result
+
 class MessagesTimer(threading.Thread):
-    def __init__(self, interval):
+    """Sends all queued messages through ``transport`` every
+    ``interval`` seconds, to be executed ``latency`` seconds later;
+    with ``coalesce`` set, drops ``/n_set`` messages that later ones
+    override first.
+
+    While the transport can't reach scsynth, the messages go back to
+    the front of the queue, to be sent with the next flush:
+
+      >>> class Down(object):
+      ...     def send_bundle(self, when, messages):
+      ...         raise transports.Unavailable('down')
+      >>> del Synth.messages[:]
+      >>> queue_messages([('/n_set', 1, 'amp', 0.1), ('/n_set', 1, 'amp', 0.2)])
+      >>> MessagesTimer(0.001, Down()).flush()
+      >>> Synth.messages
+      [('/n_set', 1, 'amp', 0.2)]
+      >>> del Synth.messages[:]
+    """
+    coalesce = False
+
+    def __init__(self, interval, transport, latency=0.001):
         super(MessagesTimer, self).__init__()
         self.interval = interval
+        self.transport = transport
+        self.latency = latency
         self.finished = threading.Event()
 
     def run(self):
-        messages = Synth.messages
         finished = self.finished
-        interval = self.interval
-        global server_lock
-
         while not finished.isSet():
-            locked = False
+            # ``interval`` may be changed by the LoadMonitor:
+            finished.wait(self.interval)
+            self.flush()
+
+    def flush(self):
+        messages = Synth.messages
+        # Take all pending messages and empty, but don't hold the
+        # lock while we're sending:
+        if not server_lock.acquire(False):
+            return
+        try:
+            pending = messages[:]
+            messages[:] = []
+        finally:
+            server_lock.release()
+
+        if pending:
+            if self.coalesce:
+                pending = coalesce(pending)
             try:
-                finished.wait(interval)
-                # Process all pending messages and empty:
-                locked = server_lock.acquire(False)
-                if not locked:
-                    continue
-                if messages:
-                    get_server().sendBundle(0.001, messages)
-                    messages[:] = []
-            finally:
-                if locked:
-                    server_lock.release()
+                self.transport.send_bundle(
+                    time.time() + self.latency, pending)
+            except transports.Unavailable:
+                # The transport logs the outage:
+                self.requeue(pending)
+            except IOError:
+                traceback.print_exc()
+
+    def requeue(self, pending):
+        """Put ``pending`` back in front of the messages queued since.
+        """
+        try:
+            server_lock.acquire()
+            Synth.messages[:0] = coalesce(pending)
+        finally:
+            server_lock.release()
+
+def dispatch(handlers, message):
+    # `message[0]` is the MIDI command, see
+    # http://ccrma-www.stanford.edu/~craig/articles/linuxmidi/misc/essenmidi.html
+    handler = handlers.get(message[0])
+    if handler is not None:
+        try:
+            handler(*message[1:])
+        except IOError:
+            traceback.print_exc()
+
+class LoadMonitor(threading.Thread):
+    """Polls scsynth's ``/status`` and degrades gracefully while the
+    server is overloaded.
+
+    Each reply that finds the server's average CPU at or above the
+    threshold of the current level, or its peak CPU at or above
+    ``peak_threshold``, raises the level by one step.  A reply that
+    arrives later than ``late_after`` does so, too, but only up to
+    ``slow_level``.  After ``recover_polls`` polls in a row with an
+    average CPU well below the previous level's threshold, we go back
+    a step.  These are the levels, see ``LEVELS``:
+
+      - ``normal``: flush messages every millisecond.
+
+      - ``throttle``: flush less often and coalesce ``/n_set``
+        messages to the same node and parameter.
+
+      - ``steal``: flush even less often; a new voice in a group that
+        has ``steal_above`` voices playing replaces the oldest one.
+
+      - ``refuse``: don't start new voices at all.
+
+    Functions passed to ``add_listener`` are called with the new
+    level, the previous level and ``stats`` whenever the level
+    changes:
+
+      >>> class Timer:
+      ...     interval, coalesce = 0.001, False
+      >>> monitor = LoadMonitor(None, Timer())
+      >>> def print_change(level, previous, stats):
+      ...     print '%s -> %s' % (previous['name'], level['name'])
+      >>> monitor.add_listener(print_change)
+      >>> monitor.status_reply(1, 100, 10, 2, 20, 65.0, 70.0, 44100., 44100.)
+      normal -> throttle
+      >>> monitor.timer.interval, monitor.timer.coalesce
+      (0.005, True)
+      >>> for i in range(monitor.recover_polls):
+      ...     monitor.status_reply(1, 100, 10, 2, 20, 5.0, 8.0, 44100., 44100.)
+      throttle -> normal
+      >>> monitor.stats['synths'], monitor.stats['avg_cpu']
+      (10, 5.0)
+
+    A poll that isn't answered by the time of the next one tells us
+    nothing about the server's load; the reply may have been lost, or
+    the server may not be running yet.  Only after ``missed_polls``
+    of these in a row do we go up a level, and no further than
+    ``slow_level``; without CPU readings we never steal or refuse
+    voices:
+
+      >>> class Listener:
+      ...     def send(self, *message):
+      ...         pass
+      >>> monitor.listener = Listener()
+      >>> for i in range(10):
+      ...     monitor.poll()
+      normal -> throttle
+      >>> monitor.stats['missed'], monitor.voice_policy(100)
+      (9, 'admit')
+
+    Each reply is matched to the oldest poll that's still waiting for
+    one, and counted as late at most once; replies to polls older than
+    ``reply_timeout`` are taken as lost:
+
+      >>> monitor.pending[:] = [time.time() - 0.2, time.time()]
+      >>> monitor.status_reply(1, 100, 10, 2, 20, 5.0, 8.0, 44100., 44100.)
+      >>> monitor.stats['late'], len(monitor.pending)
+      (1, 1)
+      >>> monitor.level['name']
+      'throttle'
+    """
+    LEVELS = (
+        dict(name='normal', interval=0.001, coalesce=False, voices='admit'),
+        dict(name='throttle', interval=0.005, coalesce=True, voices='admit'),
+        dict(name='steal', interval=0.01, coalesce=True, voices='steal'),
+        dict(name='refuse', interval=0.02, coalesce=True, voices='refuse'),
+        )
+
+    # The highest level that slow or missing replies take us to:
+    slow_level = 1
+
+    def __init__(self, listener, timer, interval=0.5,
+                 thresholds=(60.0, 75.0, 90.0), peak_threshold=95.0,
+                 hysteresis=10.0, recover_polls=4, late_after=0.1,
+                 missed_polls=3, reply_timeout=2.0, steal_above=4):
+        super(LoadMonitor, self).__init__()
+        self.setDaemon(True)
+        self.listener = listener
+        self.timer = timer
+        self.interval = interval
+        self.thresholds = thresholds
+        self.peak_threshold = peak_threshold
+        self.hysteresis = hysteresis
+        self.recover_polls = recover_polls
+        self.late_after = late_after
+        self.missed_polls = missed_polls
+        self.reply_timeout = reply_timeout
+        self.steal_above = steal_above
+        self.finished = threading.Event()
+        self.listeners = []
+        self.level = self.LEVELS[0]
+        self.calm = 0
+        self.missed = 0
+        self.replies = 0
+        # Times that the polls still waiting for a reply were sent:
+        self.pending = []
+        self.stats = dict(avg_cpu=0.0, peak_cpu=0.0, ugens=0, synths=0,
+                          groups=0, synthdefs=0, late=0, missed=0, polls=0)
+        if listener is not None:
+            listener.add_handler('/status.reply', self.status_reply)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def run(self):
+        while not self.finished.isSet():
+            self.poll()
+            self.finished.wait(self.interval)
+
+    def poll(self):
+        now = time.time()
+        pending = self.pending
+        if pending and pending[-1] > now - self.reply_timeout:
+            # Our last poll wasn't answered (yet):
+            self.stats['missed'] += 1
+            self.missed += 1
+            if self.missed == self.missed_polls and not self.replies:
+                logger.warning("%s:%s doesn't answer /status over UDP; "
+                               "is scsynth running with -u?" % (
+                                   self.listener.address))
+            if self.missed >= self.missed_polls:
+                self.missed = 0
+                index = self.LEVELS.index(self.level)
+                if index < self.slow_level:
+                    self.calm = 0
+                    self.set_level(index + 1)
+        pending[:] = [sent for sent in pending
+                      if sent > now - self.reply_timeout]
+        pending.append(now)
+        self.stats['polls'] += 1
+        self.listener.send('/status')
+
+    def status_reply(self, unused, ugens, synths, groups, synthdefs,
+                     avg_cpu, peak_cpu, *args):
+        """Handles scsynth's ``/status.reply``.
+        """
+        now = time.time()
+        pending = self.pending
+        while pending and pending[0] <= now - self.reply_timeout:
+            del pending[0]
+        late = False
+        if pending:
+            late = now - pending.pop(0) > self.late_after
+        self.missed = 0
+        self.replies += 1
+        stats = self.stats
+        if late:
+            stats['late'] += 1
+        stats.update(ugens=ugens, synths=synths, groups=groups,
+                     synthdefs=synthdefs, avg_cpu=avg_cpu, peak_cpu=peak_cpu)
+        self.adjust(overloaded=late)
+
+    def adjust(self, overloaded=False):
+        """Go up a level if the CPU load is too high, or up to
+        ``slow_level`` if we're ``overloaded`` otherwise; go down a
+        level if the load has been low for long enough.
+        """
+        index = self.LEVELS.index(self.level)
+        avg_cpu = self.stats['avg_cpu']
+        if (index < len(self.thresholds) and (
+            avg_cpu >= self.thresholds[index] or
+            self.stats['peak_cpu'] >= self.peak_threshold) or
+            overloaded and index < self.slow_level):
+            self.calm = 0
+            self.set_level(index + 1)
+        elif index and avg_cpu < self.thresholds[index - 1] - self.hysteresis:
+            self.calm += 1
+            if self.calm >= self.recover_polls:
+                self.calm = 0
+                self.set_level(index - 1)
+        else:
+            self.calm = 0
+
+    def set_level(self, index):
+        previous, level = self.level, self.LEVELS[index]
+        if level is previous:
+            return
+        self.level = level
+        self.timer.interval = level['interval']
+        self.timer.coalesce = level['coalesce']
+        logger.warning("Server load %s: avg CPU %.1f%%, peak CPU %.1f%%; "
+                       "going from %s to %s" % (
+                           index > self.LEVELS.index(previous) and 'up'
+                           or 'down', self.stats['avg_cpu'],
+                           self.stats['peak_cpu'], previous['name'],
+                           level['name']))
+        for listener in self.listeners:
+            try:
+                listener(level, previous, self.stats)
+            except Exception:
+                traceback.print_exc()
+
+    def voice_policy(self, playing):
+        """Return what to do about a new voice in a group that has
+        ``playing`` voices: ``admit``, ``steal`` or ``refuse``.
+        """
+        policy = self.level['voices']
+        if policy == 'steal' and playing < self.steal_above:
+            return 'admit'
+        return policy
+
+class ServerListener(threading.Thread):
+    """Receives notifications and replies from scsynth on a socket of
+    its own.
+
+    Use ``add_handler`` to register a function for an OSC address;
+    the function is called with the message's arguments.
+    """
+    def __init__(self, address, timeout=0.5):
+        super(ServerListener, self).__init__()
+        self.setDaemon(True)
+        self.address = address
+        self.handlers = {}
+        self.finished = threading.Event()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', 0))
+        self.socket.settimeout(timeout)
+
+    def add_handler(self, address, handler):
+        self.handlers.setdefault(address, []).append(handler)
+
+    def send(self, *message):
+        self.socket.sendto(osc.encode_message(*message), self.address)
+
+    def run(self):
+        self.send('/notify', 1)
+        while not self.finished.isSet():
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                continue
+            try:
+                messages = osc.decode(data)
+            except osc.OSCError:
+                traceback.print_exc()
+                continue
+            for message in messages:
+                for handler in self.handlers.get(message[0], ()):
+                    try:
+                        handler(*message[1:])
+                    except Exception:
+                        traceback.print_exc()
+        self.send('/notify', 0)
 
 class MidiIn(threading.Thread):
     running = True
@@ -233,18 +1010,116 @@ class MidiIn(threading.Thread):
             if message:
                 if verbose:
                     logger.debug("%r received: %s" % (self, message))
-                # `message[0]` is the MIDI command, see
-                # http://ccrma-www.stanford.edu/~craig/articles/linuxmidi/misc/essenmidi.html
-                handler = self.handlers.get(message[0])
-                if handler is not None:
+                dispatch(self.handlers, message)
+
+    def __repr__(self):
+        return '<MidiIn port=%r>' % (self.midi.getPortName(self.port))
+                
+
+class OscIn(threading.Thread):
+    """Receives parameter automation over OSC, e.g. from a sequencer.
+
+    Messages look like ``/midi2sc/set group param value``, with any
+    number of ``group param value`` triples per message.  The value
+    is passed to the ``update_value`` method of the control that's
+    bound to ``param`` in the ``group`` section of the configuration.
+
+    All messages of one packet, that is, of one message or of one
+    bundle, are applied as one batch, and they'll reach scsynth in
+    one bundle.
+
+    Controls are looked up in ``midi_in.handlers`` each time, so OSC
+    follows the handlers that ``load_presets`` installs:
+
+      >>> import os, tempfile
+      >>> from midi2sc import control
+      >>> class Input(object): pass
+      >>> midi_in = Input()
+      >>> midi_in.handlers = {0xb0: control.GroupControl({1:
+      ...     control.AbsoluteControl('oscin', 200.0, 2000.0,
+      ...                             param_name='cutoff')})}
+      >>> osc_in = OscIn(0, midi_in)
+      >>> fd, filename = tempfile.mkstemp()
+      >>> os.close(fd)
+      >>> save_presets(filename, midi_in)
+      >>> handlers = load_presets(filename, midi_in)
+      >>> osc_in.apply([('/midi2sc/set', 'oscin', 'cutoff', 1100.0)])
+      >>> round(handlers[0xb0][1].value, 6)
+      1100.0
+      >>> os.remove(filename)
+      >>> osc_in.socket.close()
+    """
+    running = True
+    address = '/midi2sc/set'
+
+    def __init__(self, port, midi_in, host='', timeout=0.5):
+        super(OscIn, self).__init__()
+        self.setDaemon(True)
+        self.port = port
+        self.midi_in = midi_in
+        self.controls = {}
+        self.controls_from = None
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(timeout)
+
+    def run(self):
+        while self.running:
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                continue
+            try:
+                messages = osc.decode(data)
+            except osc.OSCError:
+                traceback.print_exc()
+                continue
+            self.apply(messages)
+
+    def apply(self, messages):
+        verbose = get_verbosity()
+        begin_batch()
+        try:
+            for message in messages:
+                if verbose:
+                    logger.debug("%r received: %s" % (self, message))
+                address, args = message[0], message[1:]
+                if address != self.address or len(args) % 3:
+                    logger.error("%r can't handle: %s" % (self, message))
+                    continue
+                for index in range(0, len(args), 3):
+                    group, param_name, value = args[index:index + 3]
+                    control = self.find_control(group, param_name)
+                    if control is None:
+                        logger.error("%r has no control for %s.%s" % (
+                            self, group, param_name))
+                        continue
                     try:
-                        handler(*message[1:])
+                        value = float(value)
+                    except (TypeError, ValueError):
+                        logger.error("%r can't set %s.%s to %r" % (
+                            self, group, param_name, value))
+                        continue
+                    try:
+                        control.update_value(value)
                     except IOError:
                         traceback.print_exc()
+        finally:
+            end_batch()
+
+    def find_control(self, group, param_name):
+        key = (group, param_name)
+        handlers = self.midi_in.handlers
+        if handlers is not self.controls_from or key not in self.controls:
+            # ``load_presets`` replaces the handlers, and configure may
+            # have added controls since we last looked:
+            from midi2sc import control
+            self.controls = control.controls_by_param(handlers)
+            self.controls_from = handlers
+        return self.controls.get(key)
 
     def __repr__(self):
-        return '<MidiIn port=%r>' % (self.midi.getPortName(self.port))
-                
+        return '<OscIn port=%r>' % self.port
 
 def ask_for_port(midi):
     ports = range(midi.getPortCount())
@@ -269,6 +1144,8 @@ def _all_notes_off(handlers):
             if isinstance(handler, control.NoteOffControl):
                 for key in handler.notes.keys():
                     handler(key, 0, None)
+            elif isinstance(handler, control.MPEHandler):
+                handler.zone.all_notes_off()
 
 def save_presets(filename, midi_in):
     handlers = midi_in.handlers
@@ -287,25 +1164,66 @@ def load_presets(filename, midi_in):
     f = open(filename, 'r')
     handlers = pickle.load(f)
     f.close()
+    from midi2sc import modulation
+    modulation.reset_modulators(handlers)
     Synth.synths.set_params_for_all()
     midi_in.handlers = handlers
     return midi_in.handlers
 
-def connect(host='localhost', port=57110, verbose=None, spew=None):
+def connect(host='localhost', port=57110, verbose=None, spew=None,
+            notify=True, monitor=True, transport='udp', **transport_options):
     if verbose is None:
         verbose = get_verbosity()
     if spew is None:
         spew = get_verbosity()
+    # ``/s_new`` and ``/s_get`` go through ``server``, and the
+    # ``ServerListener`` and ``LoadMonitor`` talk to scsynth through a
+    # socket of their own; all of these use UDP.  Only the bundles of
+    # ``/n_set`` messages go through ``transport``, so with the tcp
+    # transport, scsynth has to listen on both, e.g. ``-u 57110 -t
+    # 57110``.
     server = scosc.Controller((host, port), verbose=verbose, spew=spew)
     set_server(server)
 
-    server._timer = timer = MessagesTimer(0.001)
+    server._transport = transports.make_transport(
+        transport, (host, port), **transport_options)
+    server._timer = timer = MessagesTimer(0.001, server._transport)
     timer.start()
 
+    server._listener = listener = None
+    if notify:
+        server._listener = listener = ServerListener((host, port))
+        listener.add_handler('/n_go', Synth.synths.node_started)
+        listener.add_handler('/n_end', Synth.synths.node_ended)
+        listener.start()
+
+    server._monitor = load_monitor = None
+    if listener is not None and monitor:
+        server._monitor = load_monitor = LoadMonitor(listener, timer)
+        load_monitor.start()
+    set_load_monitor(load_monitor)
+
     return server
 
+def connect_from_options(options):
+    transport = options.get('transport') or 'udp'
+    transport_options = {}
+    if transport == 'udp' and options.get('max_datagram'):
+        transport_options['max_size'] = int(options['max_datagram'])
+    return connect(options.get('host') or 'localhost',
+                   options.get('port') and int(options['port']) or 57110,
+                   transport=transport, **transport_options)
+
 def disconnect():
-    get_server()._timer.finished.set()
+    server = get_server()
+    server._timer.finished.set()
+    server._timer.join()
+    server._transport.close()
+    if server._listener is not None:
+        server._listener.finished.set()
+    if server._monitor is not None:
+        server._monitor.finished.set()
+        set_load_monitor(None)
 
 def _parse_options():
     parser = optparse.OptionParser()
@@ -316,8 +1234,24 @@ def _parse_options():
     parser.add_option('-p', "--port", dest="port", metavar="PORT",
                       default='57110',
                       help="Port of SuperCollider server [57710]")
+    parser.add_option('-t', "--transport", dest="transport",
+                      metavar="TRANSPORT", default='udp',
+                      help="Send bundles over 'udp' or 'tcp' [udp]; "
+                      "for tcp, start scsynth with both -u PORT and "
+                      "-t PORT")
+    parser.add_option("--max-datagram", dest="max_datagram", type="int",
+                      metavar="BYTES",
+                      help="Split UDP bundles into datagrams of at most "
+                      "BYTES [%d]" % transports.DEFAULT_MAX_DATAGRAM)
     parser.add_option('-m', "--midi-port", dest="midi_port", metavar="MIDIPORT",
                       help="MIDI port to bind to (default: ask)")
+    parser.add_option('-o', "--osc-port", dest="osc_port", metavar="OSCPORT",
+                      help="UDP port to receive OSC automation on "
+                      "(default: none)")
+    parser.add_option('-P', "--processes",
+                      action="store_true", dest="processes", default=False,
+                      help="Run MIDI input, synth control and GUI in "
+                      "separate processes")
     parser.add_option("-v", "--verbose",
                       action="store_true", dest="verbose", default=False,
                       help="Make lots of noise")
@@ -337,8 +1271,12 @@ def main(options=None, callback=None):
         options = dict(options.__dict__)
 
     set_verbosity(options['verbose'])
-    server = connect(options.get('host') or 'localhost',
-                     options.get('port') and int(options['port']) or 57110)
+
+    if options.get('processes'):
+        from midi2sc import multiproc
+        return multiproc.main(options)
+
+    server = connect_from_options(options)
 
     midi = rtmidi.RtMidiIn()
     midi_port = options.get('midi_port')
@@ -351,6 +1289,11 @@ def main(options=None, callback=None):
     midi_in = MidiIn(midi, midi_port, handlers=handlers)
     midi_in.start()
 
+    osc_port = options.get('osc_port')
+    if osc_port is not None:
+        osc_in = OscIn(int(osc_port), midi_in)
+        osc_in.start()
+
     if callback is None:
         from midi2sc import gui
         gui.start()
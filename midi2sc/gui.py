@@ -84,6 +84,7 @@ class ScaleFrame(Tkinter.LabelFrame):
         scale.set(value)
 
 window = None
+_detached = False
 
 def start():
     global window
@@ -91,6 +92,8 @@ def start():
     window.start()
 
 def register(control):
+    if _detached:
+        return
     _queue.put((_register, (control,), {}))
 
 def _register(control):
@@ -105,6 +108,8 @@ def _register(control):
     scale_frame.add(control)
 
 def _update(control, value):
+    if _detached:
+        return
     _queue.put((_do_update, (control, value), {}))
 
 def _do_update(control, value):
@@ -123,3 +128,15 @@ def disable_updates():
 def enable_updates():
     global update
     update = _update
+
+def detach():
+    """Drop pending and future GUI work in a process that doesn't
+    run the GUI.
+    """
+    global _detached
+    _detached = True
+    while True:
+        try:
+            _queue.get(block=False)
+        except Queue.Empty:
+            break
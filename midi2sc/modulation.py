@@ -0,0 +1,536 @@
+"""Time-based modulation of synth parameters: LFOs and envelopes.
+
+Modulators add a moving offset on top of a base value, which is
+usually the value of the ``AbsoluteControl`` or ``IncDecControl``
+that's bound to the same parameter.  All modulators are evaluated
+together as NumPy arrays by the ``ModulationEngine`` at a fixed
+control rate, and all resulting ``/n_set`` messages of one tick are
+queued at once, so that they go out in one bundle.
+
+In the configuration, modulators are options whose name is ``mod.``
+followed by the parameter name::
+
+  [SOSkick]
+  midi_channel = 01
+  001 = amp_mul=    AbsoluteControl(min=0.0, max=1.27)
+  mod.amp_mul =     LFO(shape='triangle', rate=4.0, depth=0.2)
+  mod.mod_freq =    Envelope(attack=0.01, decay=0.2, sustain=0.3,
+                             release=0.5, depth=10.0, base=2.0)
+
+An LFO oscillates between ``-depth`` and ``depth`` with ``rate``
+cycles per second; ``shape`` is one of ``sine``, ``triangle``,
+``saw`` and ``square``.  An LFO sets its parameter for all synths of
+its group.  An envelope runs for each synth on its own: it starts when
+the synth is added to its group, and is released when the synth is
+removed, e.g. by a note-off.
+
+The modulators of a section are kept in the ``modulators`` attribute
+of its ``GroupControl``, and the engine runs those of the handlers
+that were read or loaded last, see ``set_modulators`` and
+``reset_modulators``.
+"""
+
+import threading
+import time
+
+import numpy
+
+from midi2sc import core
+
+SHAPES = ('sine', 'triangle', 'saw', 'square')
+
+LFO_KIND, ENVELOPE_KIND = 0, 1
+
+class Modulator(object):
+    """Base class of modulators; while it's attached to an engine, a
+    modulator is also an event listener of its group, so that new
+    synths start with its current value.
+    """
+    kind = None
+
+    def __init__(self, group, param_name='freq', depth=1.0, base=0.0):
+        self.group = group
+        self.param_name = param_name
+        self.depth = depth
+        self.base = base
+        self.value = None
+        self.engine = None
+        self.index = None
+
+    @property
+    def base_value(self):
+        """The value we modulate around; ``base`` is either a number
+        or a control.
+        """
+        value = getattr(self.base, 'value', self.base)
+        return numpy.nan if value is None else value
+
+    @property
+    def range(self):
+        return (getattr(self.base, 'min', None),
+                getattr(self.base, 'max', None))
+
+    def attach(self, engine):
+        self.engine = engine
+        watch = getattr(self.base, 'watch', None)
+        if watch is not None:
+            watch(self.base_changed)
+        core.Synth.synths.event_listeners[self.group].add(self)
+
+    def detach(self):
+        unwatch = getattr(self.base, 'unwatch', None)
+        if unwatch is not None:
+            unwatch(self.base_changed)
+        core.Synth.synths.event_listeners[self.group].discard(self)
+        self.engine = self.index = None
+
+    def base_changed(self, control):
+        engine = self.engine
+        if engine is not None:
+            engine.set_base(self)
+
+    def set_params_for(self, synth):
+        if self.value is not None:
+            synth[self.param_name] = self.value
+
+    def synth_removed(self, synth):
+        pass
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(engine=None, index=None, value=None)
+        return state
+
+    def __repr__(self):
+        return "<%s for %r param %r>" % (
+            self.__class__.__name__, self.group, self.param_name)
+
+class LFO(Modulator):
+    kind = LFO_KIND
+
+    def __init__(self, group, shape='sine', rate=1.0, phase=0.0, **kwargs):
+        if shape not in SHAPES:
+            raise ValueError("Unknown LFO shape %r" % shape)
+        self.shape = shape
+        self.rate = rate
+        self.phase = phase
+        super(LFO, self).__init__(group, **kwargs)
+
+class Envelope(Modulator):
+    kind = ENVELOPE_KIND
+
+    def __init__(self, group, attack=0.01, decay=0.1, sustain=1.0,
+                 release=0.1, **kwargs):
+        self.attack = attack
+        self.decay = decay
+        self.sustain = sustain
+        self.release = release
+        super(Envelope, self).__init__(group, **kwargs)
+
+    def set_params_for(self, synth):
+        engine = self.engine
+        if engine is not None:
+            engine.trigger(self, synth.id)
+
+    def synth_removed(self, synth):
+        engine = self.engine
+        if engine is not None:
+            # There's nothing left to modulate of a synth that ended:
+            engine.release(self, synth.id, drop=synth.ended)
+
+VOICE_ARRAYS = (
+    ('voice_mod', int, 0),
+    ('voice_id', int, 0),
+    ('trigger_time', float, 0.0),
+    ('release_time', float, numpy.inf),
+    ('release_level', float, 0.0),
+    ('level', float, 0.0),
+    ('voice_last', float, numpy.nan),
+    )
+
+class ModulationEngine(threading.Thread):
+    """Evaluates all modulators ``rate`` times per second.
+
+    LFOs have one row per modulator in the engine's arrays; envelopes
+    have one row per voice, that is, per modulator and synth.  Base
+    values are updated when their controls change, and voices are
+    added and released when synths come and go, so that a tick only
+    does array arithmetic and builds the messages for values that
+    changed:
+
+      >>> engine = ModulationEngine()
+      >>> env = Envelope('engine-group', param_name='cutoff', base=100.0,
+      ...                depth=100.0, attack=1.0, release=1.0)
+      >>> engine.set_modulators('engine-group', [env])
+      >>> synths = [core.Synth('engine-group'), core.Synth('engine-group')]
+      >>> engine.tick(now=engine.trigger_time[0] + 0.5)
+      2
+      >>> [round(synth['cutoff']) for synth in synths]
+      [150.0, 150.0]
+
+    Adding a synth starts an envelope of its own; removing one
+    releases only its envelope:
+
+      >>> synths.append(core.Synth('engine-group'))
+      >>> synths[0].remove() is synths[0]
+      True
+      >>> engine.voices
+      3
+      >>> (engine.release_time[:3] < numpy.inf).tolist()
+      [True, False, False]
+
+    A released voice runs until its release ends, unless the server
+    frees the synth before that:
+
+      >>> engine.drop_synth(synths[0].id)
+      >>> engine.voices
+      2
+
+    ``late`` counts the ticks that we couldn't start on time because
+    the previous one took too long.
+    """
+    def __init__(self, rate=100.0):
+        super(ModulationEngine, self).__init__()
+        self.setDaemon(True)
+        self.rate = rate
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.modulators = []
+        self.late = 0
+        self.start_time = time.time()
+        self.voices = 0
+        self.voice_capacity = 8
+        self.voice_rows = {}   # (modulator, synth id) -> row
+        self.voice_keys = []   # row -> (modulator, synth id)
+        for name, dtype, default in VOICE_ARRAYS:
+            array = numpy.empty(self.voice_capacity, dtype=dtype)
+            array.fill(default)
+            setattr(self, name, array)
+        self._build()
+
+    def add(self, modulator):
+        try:
+            self.lock.acquire()
+            modulator.attach(self)
+            self.modulators.append(modulator)
+            self._build()
+        finally:
+            self.lock.release()
+
+    def set_modulators(self, group, modulators):
+        """Replace the modulators of ``group`` with ``modulators``.
+        """
+        try:
+            self.lock.acquire()
+            kept = []
+            for modulator in self.modulators:
+                if modulator.group == group:
+                    modulator.detach()
+                else:
+                    kept.append(modulator)
+            for modulator in modulators:
+                modulator.attach(self)
+            self.modulators = kept + list(modulators)
+            self._build()
+        finally:
+            self.lock.release()
+
+    def reset(self, modulators):
+        """Replace all modulators with ``modulators``.
+        """
+        try:
+            self.lock.acquire()
+            for modulator in self.modulators:
+                modulator.detach()
+            for modulator in modulators:
+                modulator.attach(self)
+            self.modulators = list(modulators)
+            self._build()
+        finally:
+            self.lock.release()
+
+    def _build(self):
+        """(Re-)build the parameter arrays from ``self.modulators``;
+        acquire ``lock``!
+        """
+        mods = self.modulators
+        for index, modulator in enumerate(mods):
+            modulator.index = index
+        attr = lambda name, default: numpy.array(
+            [getattr(m, name, default) for m in mods], dtype=float)
+
+        self.kind = numpy.array([m.kind for m in mods], dtype=int)
+        self.is_lfo = self.kind == LFO_KIND
+        self.shape = numpy.array(
+            [SHAPES.index(getattr(m, 'shape', 'sine')) for m in mods],
+            dtype=int)
+        self.lfo_rate = attr('rate', 0.0)
+        self.lfo_phase = attr('phase', 0.0)
+        self.depth = attr('depth', 0.0)
+        self.attack = numpy.maximum(attr('attack', 0.0), 1e-6)
+        self.decay = numpy.maximum(attr('decay', 0.0), 1e-6)
+        self.sustain = attr('sustain', 0.0)
+        self.release_duration = numpy.maximum(attr('release', 0.0), 1e-6)
+        ranges = [m.range for m in mods]
+        self.low = numpy.array(
+            [-numpy.inf if lo is None else lo for lo, hi in ranges])
+        self.high = numpy.array(
+            [numpy.inf if hi is None else hi for lo, hi in ranges])
+        self.base = numpy.array([m.base_value for m in mods], dtype=float)
+        self.last = numpy.empty(len(mods))
+        self.last.fill(numpy.nan)
+
+        # Drop the voices of modulators that are gone, and renumber
+        # the others:
+        gone = [row for row, (m, id) in enumerate(self.voice_keys)
+                if m.engine is not self]
+        self._drop_voices(gone)
+        self.voice_mod[:self.voices] = [
+            m.index for m, id in self.voice_keys]
+
+    def set_base(self, modulator):
+        try:
+            self.lock.acquire()
+            if modulator.index is not None:
+                self.base[modulator.index] = modulator.base_value
+        finally:
+            self.lock.release()
+
+    def trigger(self, modulator, id):
+        """Start the envelope ``modulator`` for synth ``id``.
+        """
+        try:
+            self.lock.acquire()
+            key = (modulator, id)
+            row = self.voice_rows.get(key)
+            if row is None:
+                if self.voices == self.voice_capacity:
+                    self._grow_voices()
+                row = self.voice_rows[key] = self.voices
+                self.voice_keys.append(key)
+                self.voices += 1
+                self.voice_mod[row] = modulator.index
+                self.voice_id[row] = id
+                self.voice_last[row] = numpy.nan
+            self.trigger_time[row] = time.time()
+            self.release_time[row] = numpy.inf
+            self.level[row] = 0.0
+        finally:
+            self.lock.release()
+
+    def release(self, modulator, id, drop=False):
+        """Release the envelope ``modulator`` of synth ``id``, or
+        forget it right away with ``drop``.
+        """
+        try:
+            self.lock.acquire()
+            row = self.voice_rows.get((modulator, id))
+            if row is None:
+                return
+            if drop:
+                self._drop_voices([row])
+            else:
+                self.release_time[row] = time.time()
+                self.release_level[row] = self.level[row]
+        finally:
+            self.lock.release()
+
+    def drop_synth(self, id):
+        """Forget all envelopes of synth ``id``, which has ended.
+        """
+        try:
+            self.lock.acquire()
+            rows = numpy.flatnonzero(self.voice_id[:self.voices] == id)
+            if len(rows):
+                self._drop_voices(rows.tolist())
+        finally:
+            self.lock.release()
+
+    def _grow_voices(self):
+        self.voice_capacity *= 2
+        for name, dtype, default in VOICE_ARRAYS:
+            old = getattr(self, name)
+            new = numpy.empty(self.voice_capacity, dtype=dtype)
+            new.fill(default)
+            new[:self.voices] = old[:self.voices]
+            setattr(self, name, new)
+
+    def _drop_voices(self, rows):
+        # Move the last row into each gap, starting with the highest
+        # row so that we never move a row that's about to be dropped:
+        for row in sorted(rows, reverse=True):
+            del self.voice_rows[self.voice_keys[row]]
+            last = self.voices - 1
+            if row != last:
+                key = self.voice_keys[row] = self.voice_keys[last]
+                self.voice_rows[key] = row
+                for name, dtype, default in VOICE_ARRAYS:
+                    array = getattr(self, name)
+                    array[row] = array[last]
+            self.voice_keys.pop()
+            self.voices -= 1
+
+    def evaluate(self, now):
+        """Return the values of all LFOs at ``now``, one per modulator,
+        and of all envelopes, one per voice.
+        """
+        # LFOs:
+        phase = numpy.mod(
+            (now - self.start_time) * self.lfo_rate + self.lfo_phase, 1.0)
+        shape = self.shape
+        lfo = numpy.select(
+            [shape == 0, shape == 1, shape == 2],
+            [numpy.sin(2 * numpy.pi * phase),
+             1.0 - 4.0 * numpy.abs(phase - 0.5),
+             2.0 * phase - 1.0],
+            numpy.where(phase < 0.5, 1.0, -1.0))
+        lfo_values = numpy.clip(
+            self.base + lfo * self.depth, self.low, self.high)
+
+        # Envelopes: attack, decay and sustain while the synth is
+        # playing, and release from wherever we were when it's
+        # removed:
+        n = self.voices
+        mod = self.voice_mod[:n]
+        attack, decay, sustain = (
+            self.attack[mod], self.decay[mod], self.sustain[mod])
+        elapsed = now - self.trigger_time[:n]
+        held = numpy.where(
+            elapsed < attack, elapsed / attack,
+            numpy.maximum(
+                sustain, 1.0 - (1.0 - sustain) * (elapsed - attack) / decay))
+        release_time = self.release_time[:n]
+        fading = self.release_level[:n] * numpy.clip(
+            1.0 - (now - release_time) / self.release_duration[mod],
+            0.0, 1.0)
+        env = numpy.where(release_time <= now, fading, held)
+        self.level[:n] = env
+        env_values = numpy.clip(
+            self.base[mod] + env * self.depth[mod],
+            self.low[mod], self.high[mod])
+        return lfo_values, env_values
+
+    def tick(self, now=None):
+        """Evaluate all modulators and queue the ``/n_set`` messages
+        for those values that changed since the last tick.
+        """
+        if now is None:
+            now = time.time()
+        try:
+            self.lock.acquire()
+            if not self.modulators:
+                return 0
+            lfo_values, env_values = self.evaluate(now)
+            lfos = numpy.flatnonzero(
+                self.is_lfo & numpy.isfinite(lfo_values) &
+                (lfo_values != self.last))
+            self.last = lfo_values
+
+            n = self.voices
+            envs = numpy.flatnonzero(
+                numpy.isfinite(env_values) &
+                (env_values != self.voice_last[:n]))
+            self.voice_last[:n] = env_values
+            env_changes = zip(
+                [self.voice_keys[row][0] for row in envs.tolist()],
+                self.voice_id[envs].tolist(), env_values[envs].tolist())
+
+            # Forget voices that have finished their release:
+            released = self.release_time[:n]
+            finished = numpy.flatnonzero(
+                now - released >= self.release_duration[self.voice_mod[:n]])
+            if len(finished):
+                self._drop_voices(finished.tolist())
+            mods = self.modulators
+        finally:
+            self.lock.release()
+
+        # Set all changed LFO parameters of a group in one go:
+        groups = {}
+        for index, value in zip(lfos.tolist(), lfo_values[lfos].tolist()):
+            modulator = mods[index]
+            modulator.value = value
+            groups.setdefault(modulator.group, []).append(
+                (modulator.param_name, value))
+
+        synths = core.Synth.synths
+        messages = []
+        for group, items in groups.items():
+            group_synths = synths.get(group)
+            if group_synths is not None:
+                messages.extend(group_synths.assign_many(items))
+
+        # Envelopes set one synth each; synths that were removed
+        # already are in their release:
+        groups = {}
+        for modulator, id, value in env_changes:
+            messages.append(('/n_set', id, modulator.param_name, value))
+            groups.setdefault(modulator.group, []).append(
+                (id, modulator.param_name, value))
+        for group, changes in groups.items():
+            group_synths = synths.get(group)
+            if group_synths is not None:
+                group_synths.store.update_many(changes)
+
+        core.queue_messages(messages)
+        return len(messages)
+
+    def run(self):
+        interval = 1.0 / self.rate
+        next_tick = time.time()
+        while not self.finished.isSet():
+            self.tick()
+            next_tick += interval
+            delay = next_tick - time.time()
+            if delay > 0:
+                self.finished.wait(delay)
+            else:
+                # We're behind; skip ticks rather than pile them up:
+                self.late += 1
+                next_tick = time.time()
+
+_engine = None
+
+def get_engine():
+    """Return the ``ModulationEngine``, starting it if necessary.
+    """
+    global _engine
+    if _engine is None:
+        _engine = ModulationEngine()
+        _engine.start()
+    return _engine
+
+def stop_engine():
+    global _engine
+    if _engine is not None:
+        _engine.finished.set()
+        _engine.reset([])
+        _engine = None
+
+def set_modulators(group, modulators):
+    """Run ``modulators`` for ``group`` instead of the ones it had.
+    """
+    if modulators or _engine is not None:
+        get_engine().set_modulators(group, modulators)
+
+def drop_synth(id):
+    """Stop modulating synth ``id``, which the server has freed.
+    """
+    if _engine is not None:
+        _engine.drop_synth(id)
+
+def modulators_in(handlers):
+    from midi2sc import control
+    modulators = []
+    for handler in handlers.values():
+        if isinstance(handler, control.GroupControl):
+            modulators.extend(handler.modulators)
+    return modulators
+
+def reset_modulators(handlers):
+    """Run the modulators of ``handlers``, and no others; used after
+    loading presets.
+    """
+    modulators = modulators_in(handlers)
+    if modulators or _engine is not None:
+        get_engine().reset(modulators)
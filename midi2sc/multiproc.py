@@ -0,0 +1,271 @@
+"""Run MIDI input, synth control and the GUI in separate processes.
+
+In the default single process layout, a Tk redraw or a garbage
+collection in one thread delays note-ons handled in another.  With
+the layout in this module, there are three processes:
+
+  - The MIDI process reads from the MIDI port and writes each message
+    as a fixed-size record into an ``EventRing`` in shared memory.
+
+  - The control process reads events off the ring, dispatches them to
+    the handlers from the configuration and sends OSC to scsynth.  It
+    periodically publishes a snapshot of all control values.
+
+  - The GUI process shows sliders for these snapshots.  Moving a
+    slider sends the new value back to the control process.
+
+The ring is a single-producer, single-consumer queue: the producer
+only ever advances ``head`` and the consumer only ever advances
+``tail``, so neither side needs a lock:
+
+  >>> ring = EventRing(slots=2)
+  >>> ring.put(0x90, 60, 100, 0.5), ring.put(0x80, 60, 0, 0.75)
+  (True, True)
+  >>> ring.put(0x90, 62, 100, 1.0)
+  False
+  >>> ring.dropped.value == 1
+  True
+  >>> ring.get_all()
+  [(144, 60, 100, 0.5), (128, 60, 0, 0.75)]
+  >>> ring.get_all()
+  []
+"""
+
+import multiprocessing
+import Queue
+import struct
+import time
+
+from midi2sc import control
+from midi2sc import core
+
+# status, data1, data2, padding, timestamp
+RECORD = struct.Struct('<BBB5xd')
+
+class EventRing(object):
+    """A ring buffer of fixed-size MIDI event records in shared
+    memory.  Create it before forking the processes that use it.
+    """
+    def __init__(self, slots=4096):
+        self.slots = slots
+        self.buffer = multiprocessing.RawArray('c', slots * RECORD.size)
+        self.head = multiprocessing.RawValue('L', 0)
+        self.tail = multiprocessing.RawValue('L', 0)
+        self.dropped = multiprocessing.RawValue('L', 0)
+
+    def put(self, status, data1, data2, timestamp):
+        """Write one event; returns False and counts the event as
+        dropped if the consumer has fallen behind by a whole ring.
+        """
+        head = self.head.value
+        if head - self.tail.value >= self.slots:
+            self.dropped.value += 1
+            return False
+        RECORD.pack_into(self.buffer, (head % self.slots) * RECORD.size,
+                         status, data1, data2, timestamp)
+        # Publish the record only after it's been written:
+        self.head.value = head + 1
+        return True
+
+    def get_all(self):
+        """Read and return all events written since the last call.
+        """
+        tail = self.tail.value
+        head = self.head.value
+        slots, size, buffer = self.slots, RECORD.size, self.buffer
+        events = []
+        while tail < head:
+            events.append(RECORD.unpack_from(buffer, (tail % slots) * size))
+            tail += 1
+        self.tail.value = tail
+        return events
+
+def midi_process(ring, midi_factory, port, stop):
+    """Read messages from MIDI ``port`` and write them into ``ring``
+    until ``stop`` is set.
+    """
+    midi = midi_factory()
+    midi.openPort(port, True)
+    put = ring.put
+    while not stop.is_set():
+        message = midi.getMessage()
+        if message:
+            status, data1, data2, timestamp = (
+                tuple(message) + (0, 0, 0.0))[:4]
+            put(status, data1, data2, timestamp or 0.0)
+
+def _gui_controls(handlers):
+    return dict((key, c) for key, c in
+                control.controls_by_param(handlers).items()
+                if c.step is not None and c.max is not None)
+
+class ControlLoop(object):
+    """Dispatch events from ``ring`` to ``handlers`` and exchange
+    control values with the GUI process through ``snapshots`` and
+    ``commands``.
+    """
+    def __init__(self, ring, handlers, snapshots=None, commands=None,
+                 poll_interval=0.0002, snapshot_interval=0.05):
+        self.ring = ring
+        self.handlers = handlers
+        self.snapshots = snapshots
+        self.commands = commands
+        self.poll_interval = poll_interval
+        self.snapshot_interval = snapshot_interval
+        self.controls = _gui_controls(handlers)
+
+    def layout(self):
+        """Describe all controls so that the GUI process can build
+        its sliders.
+        """
+        return [dict(group=c.group, param_name=c.param_name, min=c.min,
+                     max=c.max, step=c.step, value=c.value)
+                for c in self.controls.values()]
+
+    def snapshot(self):
+        return dict((key, control.value)
+                    for key, control in self.controls.items())
+
+    def run(self, stop):
+        handlers = self.handlers
+        get_all = self.ring.get_all
+        next_snapshot = 0
+
+        while not stop.is_set():
+            events = get_all()
+            for status, data1, data2, timestamp in events:
+                core.dispatch(handlers, (status, data1, data2, timestamp))
+
+            if self.snapshots is not None:
+                now = time.time()
+                if now >= next_snapshot:
+                    self._exchange()
+                    next_snapshot = now + self.snapshot_interval
+
+            if not events:
+                time.sleep(self.poll_interval)
+
+    def _exchange(self):
+        while True:
+            try:
+                group, param_name, value = self.commands.get(block=False)
+            except Queue.Empty:
+                break
+            control = self.controls.get((group, param_name))
+            if control is not None:
+                control.update_value(value)
+        try:
+            self.snapshots.put(self.snapshot(), block=False)
+        except Queue.Full:
+            pass # the GUI is busy; it'll get the next one
+
+def control_process(ring, options, stop, layout, snapshots, commands):
+    """Connect to scsynth, read the configuration and run a
+    ``ControlLoop`` until ``stop`` is set.  With ``osc_port`` in
+    ``options``, OSC automation is received in this process, too.
+    """
+    from midi2sc import gui
+    gui.detach()
+    core.connect_from_options(options)
+    from midi2sc import configure
+    handlers = configure.read(options.get('filename') or 'midi2sc.ini')
+    loop = ControlLoop(ring, handlers, snapshots, commands)
+    layout.put(loop.layout())
+    osc_in = None
+    if options.get('osc_port') is not None:
+        osc_in = core.OscIn(int(options['osc_port']), loop)
+        osc_in.start()
+    try:
+        loop.run(stop)
+    finally:
+        if osc_in is not None:
+            osc_in.running = False
+        core.disconnect()
+
+class ControlProxy(object):
+    """Stands in for a control of the control process inside the GUI
+    process.
+    """
+    def __init__(self, commands, group, param_name, min, max, step, value):
+        self.commands = commands
+        self.group = group
+        self.param_name = param_name
+        self.min = min
+        self.max = max
+        self.step = step
+        self.value = value
+
+    def update_value(self, value):
+        if value != self.value:
+            self.value = value
+            self.commands.put((self.group, self.param_name, value))
+
+def gui_process(layout, snapshots, commands, stop):
+    from midi2sc import gui
+
+    proxies = {}
+    for info in layout.get():
+        proxy = ControlProxy(commands, **info)
+        proxies[(proxy.group, proxy.param_name)] = proxy
+    gui.start()
+    for proxy in proxies.values():
+        gui.register(proxy)
+
+    while not stop.is_set():
+        try:
+            snapshot = snapshots.get(timeout=0.5)
+        except Queue.Empty:
+            continue
+        for key, value in snapshot.items():
+            proxy = proxies.get(key)
+            if proxy is not None and value is not None and \
+                   value != proxy.value:
+                proxy.value = value
+                gui.update(proxy, value)
+
+def start(options, midi_factory, midi_port, with_gui=True):
+    """Start all processes; returns the ``stop`` event and the list
+    of processes started.
+    """
+    ring = EventRing()
+    stop = multiprocessing.Event()
+    layout = multiprocessing.Queue()
+    snapshots = multiprocessing.Queue(maxsize=1)
+    commands = multiprocessing.Queue()
+
+    processes = [
+        multiprocessing.Process(
+            target=control_process, name='midi2sc-control',
+            args=(ring, options, stop, layout,
+                  with_gui and snapshots or None, commands)),
+        multiprocessing.Process(
+            target=midi_process, name='midi2sc-midi',
+            args=(ring, midi_factory, midi_port, stop)),
+        ]
+    if with_gui:
+        processes.append(multiprocessing.Process(
+            target=gui_process, name='midi2sc-gui',
+            args=(layout, snapshots, commands, stop)))
+    for process in processes:
+        process.daemon = True
+        process.start()
+    return stop, processes
+
+def main(options):
+    import rtmidi
+
+    midi_port = options.get('midi_port')
+    if midi_port is None:
+        midi_port = core.ask_for_port(rtmidi.RtMidiIn())
+    midi_port = int(midi_port)
+
+    stop, processes = start(options, rtmidi.RtMidiIn, midi_port)
+    core.logger.info("Started %s" % ', '.join(p.name for p in processes))
+    try:
+        while all(p.is_alive() for p in processes):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for process in processes:
+        process.join(1.0)
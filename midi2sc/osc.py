@@ -0,0 +1,268 @@
+"""Encoding and decoding of OSC packets.
+
+Messages are tuples of an address followed by arguments, the same
+format that we queue up in ``Synth.messages``:
+
+  >>> data = encode_message('/n_set', 2000, 'freq', 440.0)
+  >>> len(data)
+  32
+  >>> decode(data)
+  [('/n_set', 2000, 'freq', 440.0)]
+
+Decoding a bundle returns all of its messages, including those of
+nested bundles, in order:
+
+  >>> data = encode_bundle(None, [('/n_set', 2000, 'amp', 0.5),
+  ...                             ('/n_free', 2001)])
+  >>> decode(data)
+  [('/n_set', 2000, 'amp', 0.5), ('/n_free', 2001)]
+"""
+
+import struct
+
+# Seconds between the NTP epoch (1900) and the Unix epoch (1970)
+NTP_DELTA = 2208988800
+
+_int = struct.Struct('>i')
+_float = struct.Struct('>f')
+_double = struct.Struct('>d')
+_timetag = struct.Struct('>II')
+
+BUNDLE_HEADER = '#bundle\0'
+
+class OSCError(ValueError):
+    pass
+
+def encode_string(value):
+    return value + '\0' * (4 - len(value) % 4)
+
+def encode_message(address, *args):
+    typetags = [',']
+    data = []
+    for arg in args:
+        if isinstance(arg, bool):
+            arg = int(arg)
+        if isinstance(arg, (int, long)):
+            typetags.append('i')
+            data.append(_int.pack(arg))
+        elif isinstance(arg, float):
+            typetags.append('f')
+            data.append(_float.pack(arg))
+        elif isinstance(arg, basestring):
+            typetags.append('s')
+            data.append(encode_string(str(arg)))
+        else:
+            raise OSCError("Can't encode %r" % (arg,))
+    return (encode_string(address) + encode_string(''.join(typetags)) +
+            ''.join(data))
+
+def timetag(when=None):
+    """Return the OSC timetag for ``when`` seconds since the epoch;
+    ``None`` means 'immediately'.
+    """
+    if when is None:
+        return _timetag.pack(0, 1)
+    seconds, fraction = divmod(when + NTP_DELTA, 1)
+    return _timetag.pack(int(seconds), int(fraction * 0x100000000))
+
+def encode_bundle(when, messages):
+    """Encode a bundle of ``messages`` to be executed at ``when``
+    seconds since the epoch.
+    """
+    data = [BUNDLE_HEADER, timetag(when)]
+    for message in messages:
+        encoded = encode_message(*message)
+        data.append(_int.pack(len(encoded)))
+        data.append(encoded)
+    return ''.join(data)
+
+def split_bundle(when, messages, max_size):
+    """Encode ``messages`` into as many bundles as needed so that each
+    one is at most ``max_size`` bytes long; all bundles have the same
+    timetag.  A message that doesn't fit into a bundle of its own
+    gets one anyway.
+
+      >>> messages = [('/n_set', 2000 + i, 'amp', 0.5) for i in range(10)]
+      >>> bundles = split_bundle(None, messages, 128)
+      >>> [len(bundle) for bundle in bundles]
+      [112, 112, 112, 48]
+      >>> sum([decode(bundle) for bundle in bundles], []) == messages
+      True
+    """
+    header = BUNDLE_HEADER + timetag(when)
+    bundles = []
+    data, size = [header], len(header)
+    for message in messages:
+        encoded = encode_message(*message)
+        length = 4 + len(encoded)
+        if size + length > max_size and len(data) > 1:
+            bundles.append(''.join(data))
+            data, size = [header], len(header)
+        data.append(_int.pack(len(encoded)))
+        data.append(encoded)
+        size += length
+    if len(data) > 1:
+        bundles.append(''.join(data))
+    return bundles
+
+class BundleEncoder(object):
+    """Encodes bundles into a buffer that's reused from one call to
+    the next.
+
+    The encoded address, type tags, node ID and parameter name of each
+    ``/n_set`` message are cached, so that encoding one of these
+    boils down to copying the cached prefix and packing the value.
+    ``bundles`` yields memoryviews into the buffer; each of them is
+    only valid until the next one is requested.  Otherwise, the
+    result is the same as that of ``split_bundle``:
+
+      >>> encoder = BundleEncoder()
+      >>> messages = [('/n_set', 2000 + i, 'amp', 0.5) for i in range(10)]
+      >>> messages.append(('/n_free', 2000))
+      >>> bundles = [view.tobytes() for view in
+      ...            encoder.bundles(None, messages, 128)]
+      >>> bundles == split_bundle(None, messages, 128)
+      True
+
+    With ``framed`` set, each bundle is prefixed by its length, as
+    needed for scsynth's TCP transport:
+
+      >>> bundle = encode_bundle(None, messages[:1])
+      >>> [view.tobytes() for view in encoder.bundles(
+      ...     None, messages[:1], framed=True)] == [
+      ...     _int.pack(len(bundle)) + bundle]
+      True
+    """
+    def __init__(self, size=1 << 16, cache_size=1 << 14):
+        self.buffer = bytearray(size)
+        self.cache_size = cache_size
+        self.prefixes = {}
+
+    def _n_set_prefix(self, id, name, tag):
+        key = (id, name, tag)
+        prefix = self.prefixes.get(key)
+        if prefix is None:
+            if len(self.prefixes) >= self.cache_size:
+                # Node IDs only ever grow, so old entries are unlikely
+                # to be of any use:
+                self.prefixes.clear()
+            prefix = self.prefixes[key] = (
+                encode_string('/n_set') + encode_string(',is' + tag) +
+                _int.pack(id) + encode_string(name))
+        return prefix
+
+    def _reserve(self, size):
+        if size > len(self.buffer):
+            # Allocate a new buffer rather than resizing, which would
+            # fail while views into the old one exist:
+            buffer = bytearray(max(size, 2 * len(self.buffer)))
+            buffer[:len(self.buffer)] = self.buffer
+            self.buffer = buffer
+        return self.buffer
+
+    def bundles(self, when, messages, max_size=None, framed=False):
+        """Encode ``messages`` into bundles of at most ``max_size``
+        bytes each, all with the same timetag.
+        """
+        start = framed and 4 or 0
+        header = BUNDLE_HEADER + timetag(when)
+        body = start + len(header)
+        buffer = self._reserve(body)
+        buffer[start:body] = header
+        pos, count = body, 0
+        pack_int, pack_float = _int.pack_into, _float.pack_into
+        n_set_prefix = self._n_set_prefix
+
+        for message in messages:
+            prefix = None
+            if message[0] == '/n_set' and len(message) == 4:
+                value = message[3]
+                if type(value) is float:
+                    prefix = n_set_prefix(message[1], message[2], 'f')
+                    pack = pack_float
+                elif type(value) is int:
+                    prefix = n_set_prefix(message[1], message[2], 'i')
+                    pack = pack_int
+            if prefix is not None:
+                length = len(prefix) + 4
+            else:
+                encoded = encode_message(*message)
+                length = len(encoded)
+
+            if (max_size is not None and count and
+                pos + 4 + length - start > max_size):
+                yield self._finish(start, pos, framed)
+                pos, count = body, 0
+
+            buffer = self._reserve(pos + 4 + length)
+            pack_int(buffer, pos, length)
+            pos += 4
+            if prefix is not None:
+                end = pos + len(prefix)
+                buffer[pos:end] = prefix
+                pack(buffer, end, value)
+            else:
+                buffer[pos:pos + length] = encoded
+            pos += length
+            count += 1
+
+        if count:
+            yield self._finish(start, pos, framed)
+
+    def _finish(self, start, end, framed):
+        if framed:
+            _int.pack_into(self.buffer, 0, end - 4)
+            start = 0
+        return memoryview(self.buffer)[start:end]
+
+def _decode_string(data, index):
+    end = data.index('\0', index)
+    return data[index:end], (end + 4) & ~3
+
+def _decode_message(data):
+    address, index = _decode_string(data, 0)
+    if index >= len(data):
+        return (address,)
+    typetags, index = _decode_string(data, index)
+    args = [address]
+    for tag in typetags[1:]:
+        if tag == 'i':
+            args.append(_int.unpack_from(data, index)[0])
+            index += 4
+        elif tag == 'f':
+            args.append(_float.unpack_from(data, index)[0])
+            index += 4
+        elif tag == 'd':
+            args.append(_double.unpack_from(data, index)[0])
+            index += 8
+        elif tag == 's':
+            value, index = _decode_string(data, index)
+            args.append(value)
+        elif tag == 'b':
+            size = _int.unpack_from(data, index)[0]
+            args.append(data[index + 4:index + 4 + size])
+            index = (index + 4 + size + 3) & ~3
+        elif tag in 'TFN':
+            args.append(dict(T=True, F=False, N=None)[tag])
+        else:
+            raise OSCError("Unsupported type tag %r" % tag)
+    return tuple(args)
+
+def decode(data):
+    """Decode a packet and return the list of messages in it.
+    """
+    try:
+        if not data.startswith(BUNDLE_HEADER):
+            return [_decode_message(data)]
+        messages = []
+        index = len(BUNDLE_HEADER) + _timetag.size
+        while index < len(data):
+            size = _int.unpack_from(data, index)[0]
+            index += 4
+            messages.extend(decode(data[index:index + size]))
+            index += size
+        return messages
+    except (struct.error, ValueError), e:
+        if isinstance(e, OSCError):
+            raise
+        raise OSCError("Malformed OSC packet: %s" % e)
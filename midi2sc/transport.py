@@ -0,0 +1,163 @@
+"""Transports that send bundles of messages to scsynth.
+
+``UDPTransport`` splits bundles into datagrams that fit ``max_size``
+bytes, since a datagram that exceeds the path MTU or the server's
+socket buffer is dropped without an error.  ``TCPTransport`` keeps one
+connection to a scsynth started with ``-t <port>`` and sends each
+bundle with the four byte length prefix that scsynth expects; it's
+lossless and doesn't need to split bundles.  While scsynth can't be
+reached over TCP, ``TCPTransport.send_bundle`` raises ``Unavailable``
+and the caller keeps the messages.
+
+A transport only carries the bundles of ``/n_set`` messages; all other
+traffic with scsynth, like ``/s_new``, notifications and ``/status``
+polls, uses UDP, so scsynth needs ``-u <port>`` in any case.
+
+Both encode with an ``osc.BundleEncoder`` and send straight from its
+buffer.
+"""
+
+import logging
+import socket
+import time
+
+from midi2sc import osc
+
+logger = logging.getLogger('midi2sc')
+
+# 1500 bytes of Ethernet MTU minus IP and UDP headers
+DEFAULT_MAX_DATAGRAM = 1472
+
+class Unavailable(socket.error):
+    """The transport can't reach scsynth right now; the bundle wasn't
+    sent.
+    """
+
+class UDPTransport(object):
+    def __init__(self, address, max_size=DEFAULT_MAX_DATAGRAM):
+        self.address = address
+        self.max_size = max_size
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.encoder = osc.BundleEncoder()
+        self.datagrams = 0
+
+    def send_bundle(self, when, messages):
+        """Send ``messages`` to be executed at ``when`` seconds since
+        the epoch.
+        """
+        sendto, address = self.socket.sendto, self.address
+        for data in self.encoder.bundles(when, messages, self.max_size):
+            sendto(data, address)
+            self.datagrams += 1
+
+    def close(self):
+        self.socket.close()
+
+    def __repr__(self):
+        return '<UDPTransport %s:%s max_size=%r>' % (
+            self.address + (self.max_size,))
+
+class TCPTransport(object):
+    """Sends bundles over one TCP connection.
+
+    If the connection breaks, we reconnect right away once, since
+    scsynth may have been restarted.  If that fails, ``send_bundle``
+    raises ``Unavailable``, and it keeps doing so without trying to
+    connect until ``retry_interval`` seconds have passed; the wait
+    doubles with every failed attempt, up to ``max_retry_interval``.
+    The outage is logged once when it begins and once when it ends:
+
+      >>> listener = socket.socket()
+      >>> listener.bind(('127.0.0.1', 0))
+      >>> address = listener.getsockname()
+      >>> transport = TCPTransport(address, retry_interval=60.0)
+      >>> messages = [('/n_set', 1000, 'amp', 0.5)]
+      >>> transport.send_bundle(None, messages) # doctest: +ELLIPSIS
+      Traceback (most recent call last):
+      ...
+      Unavailable: [Errno ...] Connection refused
+      >>> transport.retry_delay
+      60.0
+      >>> listener.listen(1)
+      >>> transport.send_bundle(None, messages)
+      Traceback (most recent call last):
+      ...
+      Unavailable: Waiting to reconnect to 127.0.0.1
+      >>> transport.retry_at = 0.0
+      >>> transport.send_bundle(None, messages)
+      >>> transport.down_since is None
+      True
+      >>> transport.close(); listener.close()
+    """
+    def __init__(self, address, timeout=5.0,
+                 retry_interval=0.1, max_retry_interval=5.0):
+        self.address = address
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.retry_delay = retry_interval
+        self.retry_at = 0.0
+        self.down_since = None
+        self.socket = None
+        self.encoder = osc.BundleEncoder()
+
+    def connect(self):
+        self.socket = socket.create_connection(self.address, self.timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send_bundle(self, when, messages):
+        if self.socket is None:
+            self._reconnect()
+        for data in self.encoder.bundles(when, messages, framed=True):
+            try:
+                self.socket.sendall(data)
+            except socket.error:
+                # Reconnect once; scsynth may have been restarted:
+                self.close()
+                self._reconnect(wait=False)
+                try:
+                    self.socket.sendall(data)
+                except socket.error, e:
+                    self.close()
+                    self._failed(e)
+
+    def _reconnect(self, wait=True):
+        now = time.time()
+        if wait and now < self.retry_at:
+            raise Unavailable("Waiting to reconnect to %s" % self.address[0])
+        try:
+            self.connect()
+        except socket.error, e:
+            self._failed(e)
+        if self.down_since is not None:
+            logger.warning("Reconnected to scsynth at %s:%s after %.1f s" % (
+                self.address + (now - self.down_since,)))
+            self.down_since = None
+            self.retry_delay = self.retry_interval
+
+    def _failed(self, error):
+        now = time.time()
+        if self.down_since is None:
+            self.down_since = now
+            logger.warning("Can't reach scsynth at %s:%s over TCP (%s); "
+                           "holding messages until it's back" % (
+                    self.address + (error,)))
+        else:
+            self.retry_delay = min(
+                self.retry_delay * 2, self.max_retry_interval)
+        self.retry_at = now + self.retry_delay
+        raise Unavailable(*error.args)
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def __repr__(self):
+        return '<TCPTransport %s:%s>' % self.address
+
+def make_transport(name, address, **kwargs):
+    factories = dict(udp=UDPTransport, tcp=TCPTransport)
+    if name not in factories:
+        raise ValueError("Unknown transport %r" % name)
+    return factories[name](address, **kwargs)
@@ -22,6 +22,7 @@ setup(name='midi2sc',
 
       packages=find_packages(exclude=['ez_setup']),
       include_package_data=True,
+      install_requires=['numpy'],
       entry_points="""
       [console_scripts]
       midi2sc=midi2sc.core:main